@@ -13,7 +13,8 @@ from functools import wraps
 from flask import Flask, jsonify, render_template, request, redirect, url_for, send_file, Response, stream_with_context, session, send_from_directory
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import text
+from sqlalchemy import text, event, func, case, literal
+from sqlalchemy.ext.hybrid import hybrid_method
 
 import config
 import threading
@@ -26,9 +27,19 @@ import base64
 from services.roster import RosterService
 from services.ban import BanService
 from services.session import SessionService
+from services.settings import SettingsService
+from services.roster_import import RosterImporter, DIFF, REPLACE, MERGE, COMPLETE, FAILED
+from services.broadcast import StatusBroadcaster
+from services.status import StatusService
+from services.stats import StatsService
+from services.events import EventBus, STATUS, ROSTER, IMPORT, TOKEN, make_transport
+from services.cache import TTLCache
+from services.memo import memoize_per_request, clear_request_memo, get_request_memo, record_request_memo, get_memo_totals
 
 # Import models
 from models.user import create_user_model
+from models.expressions import whole_seconds_between
+from models.types import UTCDateTime
 
 app = Flask(__name__)
 # Enable CORS for all domains for now (development mode)
@@ -51,6 +62,31 @@ app.config["GOOGLE_CLIENT_SECRET"] = getattr(config, 'GOOGLE_CLIENT_SECRET', '')
 db = SQLAlchemy(app)
 TZ = ZoneInfo(config.TIMEZONE)
 
+# Any write (or transaction boundary) invalidates the per-request memo
+for _memo_event in ("after_flush", "after_commit", "after_soft_rollback"):
+    event.listen(db.session, _memo_event, clear_request_memo)
+
+def _make_event_transport():
+    with app.app_context():
+        return make_transport(config.EVENT_TRANSPORT, db.engine, config.EVENT_SOCKET_DIR)
+
+# Tenant change events, published to every worker once the writing transaction commits
+event_bus = EventBus(_make_event_transport)
+event_bus.attach(db.session)
+
+def notify_tenant(user_id: Optional[int], *kinds: str) -> None:
+    """Announce a change to a tenant's state when the current transaction commits.
+
+    Status changes also bump the tenant's state_version in the same
+    transaction, which retires /api/status ETags handed out before it.
+    """
+    event_bus.notify(db.session, user_id, *kinds)
+    if user_id is not None and (not kinds or STATUS in kinds):
+        Settings.query.filter_by(user_id=user_id).update(
+            {Settings.state_version: Settings.state_version + 1},
+            synchronize_session=False
+        )
+
 # Encryption Key Setup
 # We derive a Fernet key from the SECRET_KEY to ensure it's deterministic but secure
 # If SECRET_KEY is changed, the database will need to be cleared/re-uploaded
@@ -66,8 +102,28 @@ cipher_suite = Fernet(_get_encryption_key())
 
 # ---------- Models ----------
 
+# Kiosk token/slug -> user_id resolution cache (positive hits only)
+kiosk_token_cache = TTLCache(maxsize=config.TOKEN_CACHE_SIZE, ttl=config.TOKEN_CACHE_TTL)
+
+def invalidate_kiosk_token_cache(user) -> None:
+    """Drop every cached token/slug that resolves to this user.
+
+    Called as the change is made; every worker (this one included) drops its
+    entries again once the change commits, so nothing cached in between, or
+    elsewhere, outlives it.
+    """
+    if user is not None and user.id is not None:
+        kiosk_token_cache.invalidate_value(user.id)
+        event_bus.notify(db.session, user.id, TOKEN)
+
+def _on_token_event(user_id: Optional[int]) -> None:
+    if user_id is not None:
+        kiosk_token_cache.invalidate_value(user_id)
+
+event_bus.subscribe(TOKEN, _on_token_event)
+
 # Create User model for multi-tenancy (2.0)
-User = create_user_model(db)
+User = create_user_model(db, on_kiosk_token_change=invalidate_kiosk_token_cache)
 
 class Student(db.Model):
     id = db.Column(db.String, primary_key=True)          # barcode value or student id
@@ -78,8 +134,8 @@ class Student(db.Model):
 class Session(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     student_id = db.Column(db.String, db.ForeignKey("student.id"), nullable=False, index=True)
-    start_ts = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
-    end_ts = db.Column(db.DateTime(timezone=True), nullable=True, index=True)
+    start_ts = db.Column(UTCDateTime, nullable=False, index=True)    # Aware UTC on every backend
+    end_ts = db.Column(UTCDateTime, nullable=True, index=True)
     ended_by = db.Column(db.String, nullable=True)       # "kiosk_scan", "override", "auto"
     room = db.Column(db.String, nullable=True)
     # 2.0: Add user_id FK (nullable for migration compatibility)
@@ -90,9 +146,41 @@ class Session(db.Model):
 
     @property
     def duration_seconds(self):
-        end = self.end_ts or datetime.now(timezone.utc)
+        return self.duration_at(datetime.now(timezone.utc))
+
+    @hybrid_method
+    def duration_at(self, now):
+        """Whole seconds from start to end, or to `now` while still open"""
+        end = self.end_ts or now
         return int((end - self.start_ts).total_seconds())
 
+    @duration_at.inplace.expression
+    @classmethod
+    def _duration_at_expression(cls, now):
+        # `now` is bound from the app's clock, so SQL and Python agree at the threshold
+        return whole_seconds_between(cls.start_ts, func.coalesce(cls.end_ts, literal(now, cls.end_ts.type)))
+
+    @hybrid_method
+    def is_overdue(self, overdue_seconds, now=None):
+        """Longer than the threshold as of `now` (default: the app's clock; works in queries too)"""
+        return self.duration_at(now or datetime.now(timezone.utc)) > overdue_seconds
+
+
+class SessionDailyRollup(db.Model):
+    """Closed sessions per student per local day, kept current as sessions end (see services/stats.py)"""
+    user_id = db.Column(db.Integer, primary_key=True)    # Session.user_id, 0 for legacy sessions without one
+    student_id = db.Column(db.String, primary_key=True)
+    local_date = db.Column(db.Date, primary_key=True)    # Local (TZ) date the sessions started on
+    count = db.Column(db.Integer, nullable=False, default=0)
+    total_seconds = db.Column(db.Integer, nullable=False, default=0)
+    overdue_count = db.Column(db.Integer, nullable=False, default=0)  # By the threshold when each ended
+    max_seconds = db.Column(db.Integer, nullable=False, default=0)
+
+    # Date-range reads across a tenant's students
+    __table_args__ = (
+        db.Index('ix_session_daily_rollup_user_date', 'user_id', 'local_date'),
+    )
+
 
 class Queue(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -111,6 +199,12 @@ class Settings(db.Model):
     auto_ban_overdue = db.Column(db.Boolean, nullable=False, default=False)
     auto_promote_queue = db.Column(db.Boolean, nullable=False, default=False)
     enable_queue = db.Column(db.Boolean, nullable=False, default=False)
+    # Bumped on every write so other workers can tell their cached copy is stale
+    version = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped on every roster (or ban flag) change so workers rebuild their student index
+    roster_generation = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped with every status change (sessions, queue, settings, names); the /api/status ETag
+    state_version = db.Column(db.Integer, nullable=False, default=0)
     # 2.0: Add user_id FK (nullable for migration compatibility, ID=1 is legacy global)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     
@@ -134,18 +228,85 @@ class StudentName(db.Model):
         db.UniqueConstraint('user_id', 'name_hash', name='uq_user_name_hash'),
     )
 
+class RosterImportJob(db.Model):
+    """A roster upload being imported in the background (see services/roster_import.py)"""
+    id = db.Column(db.String(32), primary_key=True)      # uuid4 hex, returned to the client
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    kind = db.Column(db.String, nullable=False)          # "diff", "replace" or "merge"
+    status = db.Column(db.String, nullable=False, default="pending", index=True)  # pending, running, complete, failed
+    payload = db.Column(db.Text, nullable=True)          # Encrypted CSV upload of jobs saved before RosterImportChunk
+    checkpoint = db.Column(db.Integer, nullable=False, default=0)  # CSV records staged by committed batches
+    rows_parsed = db.Column(db.Integer, nullable=False, default=0)
+    rows_encrypted = db.Column(db.Integer, nullable=False, default=0)
+    rows_stored = db.Column(db.Integer, nullable=False, default=0)
+    rows_failed = db.Column(db.Integer, nullable=False, default=0)
+    result = db.Column(db.Text, nullable=True)           # JSON summary once complete
+    error = db.Column(db.Text, nullable=True)
+    lease = db.Column(db.String(32), nullable=True)      # Identifies the worker currently running the job
+    created_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    heartbeat_at = db.Column(db.DateTime(timezone=True), nullable=False, default=lambda: datetime.now(timezone.utc))
+    finished_at = db.Column(db.DateTime(timezone=True), nullable=True)
+
+class RosterImportChunk(db.Model):
+    """Encrypted piece of an import job's uploaded CSV, dropped once the job finishes"""
+    job_id = db.Column(db.String(32), db.ForeignKey('roster_import_job.id'), primary_key=True)
+    seq = db.Column(db.Integer, primary_key=True)        # Position in the upload, from 0
+    data = db.Column(db.Text, nullable=False)
+
+class RosterImportRow(db.Model):
+    """Staged student_name row of an unfinished import job"""
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(32), db.ForeignKey('roster_import_job.id'), nullable=False)
+    name_hash = db.Column(db.String, nullable=False)
+    encrypted_id = db.Column(db.String, nullable=True)
+    display_name = db.Column(db.String, nullable=False)
+    
+    # Diff apply joins staged rows to the roster by hash
+    __table_args__ = (
+        db.Index('ix_roster_import_row_job_hash', 'job_id', 'name_hash'),
+    )
+
 # ---------- Service Initialization ----------
 # Initialize services after models are defined
 roster_service: Optional[RosterService] = None
 ban_service: Optional[BanService] = None
 session_service: Optional[SessionService] = None
+settings_service: Optional[SettingsService] = None
+roster_importer: Optional[RosterImporter] = None
+status_service: Optional[StatusService] = None
+stats_service: Optional[StatsService] = None
+
+# Settings used when there is no tenant context (legacy/anonymous)
+DEFAULT_SETTINGS = {
+    "room_name": config.ROOM_NAME, 
+    "capacity": config.CAPACITY, 
+    "overdue_minutes": getattr(config, "MAX_MINUTES", 10), 
+    "kiosk_suspended": False, 
+    "auto_ban_overdue": False,
+    "enable_queue": False,
+    "auto_promote_queue": False
+}
 
 def initialize_services():
     """Initialize service layer after app context is available"""
-    global roster_service, ban_service, session_service
-    roster_service = RosterService(db, cipher_suite, StudentName)
-    ban_service = BanService(db, StudentName, roster_service)
+    global roster_service, ban_service, session_service, settings_service, roster_importer, status_service, stats_service
+    roster_service = RosterService(db, cipher_suite, StudentName, Settings,
+                                   unknown_code_ttl=config.UNKNOWN_CODE_TTL,
+                                   generation_check_seconds=config.ROSTER_GENERATION_CHECK,
+                                   on_change=lambda user_id: notify_tenant(user_id, ROSTER, STATUS))
+    ban_service = BanService(db, StudentName, Session, roster_service)
     session_service = SessionService(db, Session)
+    settings_service = SettingsService(db, Settings, DEFAULT_SETTINGS, revalidate_seconds=config.SETTINGS_CACHE_TTL,
+                                       on_change=notify_tenant)
+    roster_importer = RosterImporter(app, db, cipher_suite, RosterImportJob, RosterImportRow, RosterImportChunk,
+                                     StudentName, Student, roster_service, batch_size=config.ROSTER_IMPORT_CHUNK_SIZE,
+                                     stale_seconds=config.ROSTER_IMPORT_STALE_SECONDS,
+                                     upload_chunk_bytes=config.ROSTER_IMPORT_UPLOAD_CHUNK,
+                                     on_progress=lambda job_id: event_bus.notify(db.session, job_id, IMPORT),
+                                     lock_tenant=lock_tenant)
+    status_service = StatusService(db, Queue, session_service, roster_service, get_settings, TZ,
+                                   ttl=config.STATUS_SNAPSHOT_TTL)
+    stats_service = StatsService(db, Session, SessionDailyRollup, TZ)
     print("Services initialized successfully")
 
 # Create tables after models are defined (works under Gunicorn too)
@@ -227,7 +388,17 @@ def initialize_database_if_needed():
                 print(f"ERROR: Database test failed: {e}")
                 raise
 
-            
+            # Backfill the session daily rollup the first time it exists alongside history
+            try:
+                if SessionDailyRollup.query.first() is None and Session.query.filter(Session.end_ts.isnot(None)).first():
+                    print(f"Backfilled session rollup: {rebuild_session_rollups()} rows")
+            except Exception as e:
+                print(f"Rollup backfill warning (non-fatal, run 'flask rebuild-rollups'): {e}")
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+
     except Exception as e:
         print(f"CRITICAL: Database initialization failed: {e}")
         import traceback
@@ -254,6 +425,20 @@ def handle_db_errors(f):
 
 # ---------- Utility (Context Resolver) ----------
 
+def resolve_kiosk_token(token: str) -> Optional[int]:
+    """Resolve a kiosk token or slug to a user_id, using the in-process cache."""
+    user_id = kiosk_token_cache.get(token)
+    if user_id is not None:
+        return user_id
+    
+    # Two indexed lookups instead of one OR query (both columns are unique)
+    user_id = db.session.query(User.id).filter(User.kiosk_token == token).scalar()
+    if user_id is None:
+        user_id = db.session.query(User.id).filter(User.kiosk_slug == token).scalar()
+    if user_id is not None:
+        kiosk_token_cache.set(token, user_id)
+    return user_id
+
 def get_current_user_id(token: Optional[str] = None) -> Optional[int]:
     """
     Get the effective user_id context.
@@ -262,9 +447,9 @@ def get_current_user_id(token: Optional[str] = None) -> Optional[int]:
     3. If legacy admin_authenticated (no user_id), return None (global).
     """
     if token:
-        user = User.query.filter((User.kiosk_token == token) | (User.kiosk_slug == token)).first()
-        if user:
-            return user.id
+        user_id = resolve_kiosk_token(token)
+        if user_id is not None:
+            return user_id
             
     if 'user_id' in session:
         return session['user_id']
@@ -290,83 +475,56 @@ def clear_memory_roster(user_id: Optional[int] = None) -> None:
 
 def refresh_roster_cache(user_id: Optional[int] = None) -> None:
     """Refresh the memory cache from the database (scoped to user)."""
-    if not roster_service:
-        return
-        
-    # Get all students for this user with non-encrypted names (or handle decryption)
-    # Simple case: Just load display_name mapped to name_hash or ID
-    # Actually memory cache maps: { id -> Name }
-    # So we need to reconstruct that.
-    
-    # 1. Clear current cache
-    clear_memory_roster(user_id)
-    
-    # 2. Query DB
-    students = StudentName.query.filter_by(user_id=user_id).all()
-    
-    # 3. Build dict
-    new_cache = {}
-    for s in students:
-        # Use encrypted_id if available (decrypted), else fallback to hash
-        # If encrypted_id is None, we can't get the original ID easily unless we used a deterministic hash
-        # But we stored `name_hash` which is `student_{user_id}_{source_id}` hashed.
-        # Wait, the Kiosk lookup hashes the input ID and checks against DB.
-        # But memory cache expects { 'real_id': 'Name' } for fast lookup on scan?
-        # NO, kiosk.js/UI sends raw ID. 
-        # If we hash it in app, we can match.
-        
-        # Actually RosterService.get_student_name checks cache first.
-        # If cache keys are raw IDs, we need raw IDs.
-        # If we only have hashes in DB, we can't repopulate cache with raw IDs!
-        
-        # HOWEVER, the `api_roster_upload` set cache with what?
-        # It didn't. It just called this missing function.
-        
-        # If we can't recover raw IDs, we can't "refresh" the cache fully for ID-based lookup
-        # UNLESS we decrypt the encrypted_id.
-        
-        if s.encrypted_id:
-            try:
-                raw_id = cipher_suite.decrypt(s.encrypted_id.encode()).decode()
-                new_cache[raw_id] = s.display_name
-            except Exception:
-                pass
-                
-    # 4. Set to cache
-    if new_cache:
-        set_memory_roster(new_cache, user_id)
+    if roster_service:
+        roster_service.refresh_cache(user_id)
 
 def get_student_name(student_id: str, fallback: str = "Student", user_id: Optional[int] = None) -> str:
     """Get student name from memory or database (scoped to user)."""
     return roster_service.get_student_name(user_id, student_id, fallback) if roster_service else fallback
 
+def get_student_names(student_ids: List[str], fallback: str = "Student",
+                      user_id: Optional[int] = None) -> Dict[str, str]:
+    """Resolve many student names at once (scoped to user).
+
+    Codes missing from the roster fall back to their legacy Student row's
+    name, then to `fallback`. Only the generic "Student" name is skipped;
+    Anonymous_<code> placeholders are returned as-is, as the per-row lookup
+    this replaced did (a later roster upload renames them).
+    """
+    if not student_ids:
+        return {}
+    names = roster_service.get_student_names(user_id, student_ids, "") if roster_service else {}
+    missing = [sid for sid in student_ids if not names.get(sid)]
+    if missing:
+        legacy = dict(db.session.query(Student.id, Student.name)
+                      .filter(Student.id.in_(missing), Student.name != "Student"))
+        for sid in missing:
+            names[sid] = legacy.get(sid) or fallback
+    return names
+
 def is_student_banned(student_id: str, user_id: Optional[int] = None) -> bool:
     """Check if a student is banned from using the restroom (scoped to user)."""
     return ban_service.is_student_banned(user_id, student_id) if ban_service else False
 
-def set_student_banned(student_id: str, banned_status: bool, user_id: Optional[int] = None) -> bool:
+def set_student_banned(student_id: str, banned_status: bool, user_id: Optional[int] = None, commit: bool = True) -> bool:
     """Ban or unban a student from using the restroom (scoped to user)."""
-    return ban_service.set_student_banned(user_id, student_id, banned_status) if ban_service else False
+    return ban_service.set_student_banned(user_id, student_id, banned_status, commit=commit) if ban_service else False
 
 def get_overdue_students(user_id: Optional[int] = None) -> List[Dict[str, Any]]:
     """Get list of students who are currently overdue (scoped to user)."""
-    if not ban_service or not session_service:
+    if not ban_service:
         return []
     try:
-        settings = get_settings(user_id)
-        open_sessions = session_service.get_open_sessions(user_id)
-        return ban_service.get_overdue_students(user_id, open_sessions, settings["overdue_minutes"])
+        return ban_service.get_overdue_students(user_id, get_settings(user_id)["overdue_minutes"])
     except Exception:
         return []
 
 def auto_ban_overdue_students(user_id: Optional[int] = None) -> Dict[str, Any]:
     """Automatically ban students who are currently overdue (scoped to user)."""
-    if not ban_service or not session_service:
+    if not ban_service:
         return {'count': 0, 'students': []}
     try:
-        settings = get_settings(user_id)
-        open_sessions = session_service.get_open_sessions(user_id)
-        return ban_service.auto_ban_overdue_students(user_id, open_sessions, settings["overdue_minutes"])
+        return ban_service.auto_ban_overdue_students(user_id, get_settings(user_id)["overdue_minutes"])
     except Exception:
         return {'count': 0, 'students': []}
 
@@ -386,64 +544,43 @@ def get_current_holder(user_id: Optional[int] = None):
     """Get the first student currently holding the pass (scoped to user)."""
     return session_service.get_current_holder(user_id) if session_service else None
 
+# pg_advisory_xact_lock(class, key) namespace for per-tenant state changes
+TENANT_LOCK_CLASS = 4107
+
+def lock_tenant(user_id: Optional[int] = None) -> None:
+    """Serialize state changes for a tenant until the current transaction ends.
+    
+    PostgreSQL: transaction-scoped advisory lock keyed by user_id.
+    SQLite: no row locks, so a no-op write to the tenant's settings row takes
+    the database write lock, which other writers wait on until we commit.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:cls, :key)"),
+                           {"cls": TENANT_LOCK_CLASS, "key": user_id or 0})
+    else:
+        db.session.execute(text("UPDATE settings SET version = version WHERE user_id IS :uid"),
+                           {"uid": user_id})
+    # Anything memoized before the lock may already be stale
+    clear_request_memo()
+
+@memoize_per_request("queue")
+def get_queue(user_id: Optional[int] = None) -> list:
+    """Get the waitlist in join order (scoped to user)."""
+    return Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()
+
 def get_settings(user_id: Optional[int] = None):
     """Get settings for a specific user. Creates default settings if user doesn't have any."""
+    if not settings_service:
+        return dict(DEFAULT_SETTINGS)
     try:
-        if user_id is not None:
-            s = Settings.query.filter_by(user_id=user_id).first()
-            if not s:
-                # Create default settings for this user (isolated from all others)
-                s = Settings(
-                    user_id=user_id,
-                    room_name="Hall Pass",
-                    capacity=1,
-                    overdue_minutes=10,
-                    kiosk_suspended=False,
-                    auto_ban_overdue=False
-                )
-                db.session.add(s)
-                db.session.commit()
-        else:
-            # Legacy/anonymous: return defaults only (don't create or use global)
-            return {
-                "room_name": config.ROOM_NAME, 
-                "capacity": config.CAPACITY, 
-                "overdue_minutes": getattr(config, "MAX_MINUTES", 10), 
-                "kiosk_suspended": False, 
-                "auto_ban_overdue": False
-            }
-        
-        # Handle case where columns might not exist yet (during migration)
-        try:
-            kiosk_suspended = s.kiosk_suspended
-        except AttributeError:
-            kiosk_suspended = False
-        
-        try:
-            auto_ban_overdue = s.auto_ban_overdue
-        except AttributeError:
-            auto_ban_overdue = False
-        
-        return {
-            "room_name": s.room_name, 
-            "capacity": s.capacity, 
-            "overdue_minutes": s.overdue_minutes, 
-            "kiosk_suspended": kiosk_suspended, 
-            "auto_ban_overdue": auto_ban_overdue,
-            "enable_queue": getattr(s, 'enable_queue', False),
-            "auto_promote_queue": getattr(s, 'auto_promote_queue', False)
-        }
+        return settings_service.get_settings(user_id)
     except Exception:
         # If query fails, return defaults
-        return {
-            "room_name": config.ROOM_NAME, 
-            "capacity": config.CAPACITY, 
-            "overdue_minutes": getattr(config, "MAX_MINUTES", 10), 
-            "kiosk_suspended": False, 
-            "auto_ban_overdue": False,
-            "enable_queue": False,
-            "auto_promote_queue": False
-        }
+        try:
+            db.session.rollback()
+        except Exception:
+            pass
+        return dict(DEFAULT_SETTINGS)
 
 @app.context_processor
 def inject_room_name():
@@ -517,9 +654,8 @@ def serve_static(filename):
 @app.route("/kiosk/<token>")
 def public_kiosk(token):
     """Public kiosk access via unique token or slug"""
-    user = User.query.filter(
-        (User.kiosk_token == token) | (User.kiosk_slug == token)
-    ).first()
+    user_id = resolve_kiosk_token(token)
+    user = User.query.get(user_id) if user_id is not None else None
     if not user:
         return "Kiosk not found", 404
         
@@ -549,9 +685,8 @@ def display():
 @app.route("/display/<token>")
 def public_display(token):
     """Public display access via unique token or slug"""
-    user = User.query.filter(
-        (User.kiosk_token == token) | (User.kiosk_slug == token)
-    ).first()
+    user_id = resolve_kiosk_token(token)
+    user = User.query.get(user_id) if user_id is not None else None
     if not user:
         return "Display not found", 404
         
@@ -647,31 +782,23 @@ def api_admin_stats():
 
     # Scope queries
     query_session = Session.query
-    query_open = Session.query.filter_by(end_ts=None)
     query_roster = StudentName.query
     
     if user_id is not None:
         query_session = query_session.filter_by(user_id=user_id)
-        query_open = query_open.filter_by(user_id=user_id)
         query_roster = query_roster.filter_by(user_id=user_id)
     
-    # Insights: Top Students (Most Sessions)
-    # Join with Student table to get names
-    from sqlalchemy import func, desc
-    top_students = db.session.query(
-        Student.name, func.count(Session.id).label('count')
-    ).select_from(Session).join(Student)\
-     .filter(Session.user_id == user_id if user_id else True)\
-     .group_by(Student.name)\
-     .order_by(desc('count'))\
-     .limit(5).all()
-     
-    # Insights: Most Overdue
-    # (Simplified for stability: Logic for 'is_overdue' in SQL is complex due to timezone/property calculation)
-    # For now, we'll return an empty list or top users to prevent 500 error
-    most_overdue = [] 
-    # Attempting to filter by Python-calculated property in SQL won't work.
-    # Future TODO: Add 'overdue_minutes' to SQL query calculation if needed.
+    snapshot = status_service.snapshot(user_id)
+    
+    # Insights, all time, from the daily rollup: Top Students (most sessions)
+    # and Most Overdue (most overdue passes)
+    usage = stats_service.student_usage(user_id, None, None, snapshot.settings["overdue_minutes"] * 60, now_utc())
+    top_usage = stats_service.top(usage, "count", 5)
+    top_overdue = [r for r in stats_service.top(usage, "overdue", 5) if r["overdue"]]
+    names = get_student_names(list(dict.fromkeys(r["student_id"] for r in top_usage + top_overdue)),
+                              "Unknown", user_id=user_id)
+    top_students = [(names[r["student_id"]], r["count"]) for r in top_usage]
+    most_overdue = [(names[r["student_id"]], r["overdue"]) for r in top_overdue]
 
     try:
         return jsonify(
@@ -683,14 +810,11 @@ def api_admin_stats():
                 "urls": public_urls
             },
             total_sessions=query_session.count(),
-            active_sessions_count=query_open.count(),
+            active_sessions_count=len(snapshot.sessions),
             roster_count=query_roster.count(),
-            memory_roster_count=len(get_memory_roster(user_id)),
-            settings=get_settings(user_id),
-            queue_list=[{
-                "name": get_student_name(q.student_id, "Unknown", user_id=user_id),
-                "student_id": q.student_id
-            } for q in Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()],
+            memory_roster_count=roster_service.get_roster_size(user_id),
+            settings=snapshot.settings,
+            queue_list=snapshot.queue_list(),
             insights={
                 "top_students": [{"name": r[0], "count": r[1]} for r in top_students],
                 "most_overdue": [{"name": r[0], "count": r[1]} for r in most_overdue]
@@ -715,17 +839,7 @@ def update_settings_api():
     data = request.get_json(silent=True) or {}
     
     # Get or create the user's settings (isolated from all other users)
-    s = Settings.query.filter_by(user_id=user_id).first()
-    if not s:
-        s = Settings(
-            user_id=user_id,
-            room_name="Hall Pass",
-            capacity=1,
-            overdue_minutes=10,
-            kiosk_suspended=False,
-            auto_ban_overdue=False
-        )
-        db.session.add(s)
+    s = settings_service.get_row(user_id)
     
     if "room_name" in data:
         s.room_name = str(data["room_name"]).strip() or s.room_name
@@ -748,8 +862,7 @@ def update_settings_api():
     if "enable_queue" in data:
         s.enable_queue = bool(data["enable_queue"])
     
-    db.session.commit()
-    return jsonify(ok=True, settings=get_settings(user_id))
+    return jsonify(ok=True, settings=settings_service.commit(user_id, s))
 
 
 @app.route("/api/settings/suspend", methods=["POST"])
@@ -766,8 +879,8 @@ def api_suspend_kiosk():
     settings = Settings.query.filter_by(user_id=user_id).first()
     if settings:
         settings.kiosk_suspended = bool(should_suspend)
-        db.session.commit()
-        return jsonify(ok=True, suspended=settings.kiosk_suspended)
+        saved = settings_service.commit(user_id, settings)
+        return jsonify(ok=True, suspended=saved["kiosk_suspended"])
     return jsonify(ok=False, error="Settings not found"), 404
 
 @app.route("/api/settings/slug", methods=["POST"])
@@ -792,6 +905,22 @@ def api_update_slug():
     
     return jsonify(ok=False, error="Invalid format"), 400
 
+def start_roster_import(kind: str, file):
+    """Save an uploaded CSV as an import job, start it, and wait briefly for it.
+
+    Returns the job; small files are usually finished by the time this returns.
+    """
+    job = roster_importer.create_job(get_current_user_id(), kind, file.stream)
+    roster_importer.start(job.id)
+    roster_importer.wait(job.id, config.ROSTER_IMPORT_WAIT)
+    db.session.refresh(job)
+    return job
+
+def roster_import_accepted(job):
+    """202 response for an import still running in the background"""
+    return jsonify(ok=True, **roster_importer.progress(job),
+                   progress_url=url_for("api_roster_import_status", job_id=job.id)), 202
+
 @app.route("/api/roster/upload", methods=["POST"])
 def api_roster_upload():
     if not is_admin_authenticated():
@@ -803,85 +932,69 @@ def api_roster_upload():
     file = request.files['file']
     if not file.filename.endswith('.csv'):
         return jsonify(ok=False, error="CSV required"), 400
-        
-    user_id = get_current_user_id()
+    
+    # Uploading a roster replaces the tenant's existing one (once the import completes).
+    # By default only the differences are applied, keeping ban flags;
+    # mode=replace deletes and reinserts everything.
+    mode = request.form.get("mode", request.args.get("mode", DIFF))
+    if mode not in (DIFF, REPLACE):
+        return jsonify(ok=False, error="mode must be 'diff' or 'replace'"), 400
     
     try:
-        # Clear existing?
-        # Behavior: Upload usually replaces or appends. 
-        # Requirement: "Uploading a roster will replace".
-        StudentName.query.filter_by(user_id=user_id).delete()
-        
-        stream = io.StringIO(file.stream.read().decode("UTF8"), newline=None)
-        reader = csv.reader(stream)
-        
-        count = 0
-        for row in reader:
-            if not row: continue
-            # Assume Col 0 = ID, Col 1 = Name (or header check)
-            # Simple heuristic: If multiple cols, assume Name is last?
-            # Or Name,ID?
-            # Standard: Name, ID  OR  ID, Name.
-            # Let's try to detect or just assume Name is first for simplicity, or Name, ID.
-            # User provided screenshot "Student data is encrypted".
-            # Let's verify legacy Logic. `update_roster` used `StudentName(name=...)`.
-            
-            # Parse CSV: Expect Name,ID or ID,Name format
-            # Try: First col is Name, second is ID (if present)
-            # Auto-detect format:
-            # Check if col 0 looks like an ID (digits) and col 1 like text
-            # Or vice versa.
-            col0 = row[0].strip() if len(row) > 0 else ""
-            col1 = row[1].strip() if len(row) > 1 else ""
-            
-            name = None
-            student_id = None
-            
-            # Simple heuristic: IDs are usually numeric. Names are not.
-            if col0 and all(c.isdigit() for c in col0) and not (col1 and all(c.isdigit() for c in col1)):
-                # Format: ID, Name
-                student_id = col0
-                name = col1
-            elif col1 and all(c.isdigit() for c in col1) and not (col0 and all(c.isdigit() for c in col0)):
-                # Format: Name, ID
-                name = col0
-                student_id = col1
-            else:
-                # Ambiguous or both strings/ints. Fallback to Name, ID default
-                name = col0
-                student_id = col1
-            
-            if not name:
-                continue
-            
-            # Use student_id for hashing if present, else fall back to row index
-            hash_source = student_id if student_id else f"row_{count}"
-            # Include user_id in hash to avoid collisions across users
-            name_hash = hashlib.sha256(f"student_{user_id}_{hash_source}".encode()).hexdigest()[:16]
-            
-            # Encrypt student_id if provided
-            encrypted_id = None
-            if student_id:
-                encrypted_id = cipher_suite.encrypt(student_id.encode()).decode()
-            
-            s = StudentName(
-                display_name=name,
-                name_hash=name_hash,
-                encrypted_id=encrypted_id,
-                user_id=user_id,
-                banned=False
-            )
-            db.session.add(s)
-            count += 1
-            
-        db.session.commit()
-        # Update memory cache
-        refresh_roster_cache(user_id)
-        return jsonify(ok=True, count=count)
-        
+        job = start_roster_import(mode, file)
     except Exception as e:
         db.session.rollback()
         return jsonify(ok=False, error=str(e)), 500
+    
+    if job.status == FAILED:
+        return jsonify(ok=False, job_id=job.id, error=job.error), 500
+    if job.status != COMPLETE:
+        return roster_import_accepted(job)
+    
+    result = roster_importer.progress(job)["result"]
+    app.logger.info("Roster upload for user %s: %d students in %.2fs (%d rows/s)",
+                    job.user_id, result["count"], result["seconds"], result["rows_per_second"])
+    return jsonify(ok=True, job_id=job.id, mode=mode, **result)
+
+@app.get("/api/roster/import/<job_id>")
+@require_admin_auth_api
+def api_roster_import_status(job_id):
+    """Progress of a background roster import"""
+    job = RosterImportJob.query.filter_by(id=job_id, user_id=get_current_user_id()).first()
+    if not job:
+        return jsonify(ok=False, message="Import not found"), 404
+    # The worker running it may have been restarted
+    if job.status not in (COMPLETE, FAILED) and roster_importer.resume_stale(job.id):
+        db.session.refresh(job)
+    return jsonify(ok=True, **roster_importer.progress(job))
+
+@app.get("/api/roster/import/<job_id>/events")
+@require_admin_auth_api
+def api_roster_import_events(job_id):
+    """Server-sent progress events for a roster import, until it finishes"""
+    user_id = get_current_user_id()
+    if not RosterImportJob.query.filter_by(id=job_id, user_id=user_id).first():
+        return jsonify(ok=False, message="Import not found"), 404
+    
+    # The job's broadcaster reads it once per tick (or checkpoint) for every
+    # stream; the stream itself holds no app context or DB connection.
+    return Response(import_broadcaster.listen(job_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
+
+def build_import_progress(job_id: str) -> Dict[str, Any]:
+    """Progress payload pushed to a roster import's event streams"""
+    job = db.session.get(RosterImportJob, job_id)
+    if job is None:
+        # Deleted mid-stream: report it as over so streams end
+        return {"job_id": job_id, "status": FAILED, "error": "Import not found"}
+    return roster_importer.progress(job)
+
+# One shared reader per import job with open event streams (per worker), woken
+# by the importer's checkpoints from any worker; streams end with the job
+import_broadcaster = StatusBroadcaster(app, db, build_import_progress, history_size=1, linger=0,
+                                       heartbeat=config.EVENTS_HEARTBEAT_SECONDS,
+                                       final=lambda payload: payload["status"] in (COMPLETE, FAILED))
+event_bus.subscribe(IMPORT, import_broadcaster.wake)
 
 @app.route("/api/roster", methods=["GET"])
 def api_roster_get():
@@ -932,7 +1045,9 @@ def api_roster_ban():
         student = StudentName.query.filter_by(user_id=user_id, name_hash=hash_key).first()
         if student:
             student.banned = bool(should_ban)
+            roster_service.bump_generation(user_id)
             db.session.commit()
+            roster_service.update_entry_by_hash(user_id, hash_key, banned=bool(should_ban))
             return jsonify(ok=True)
         else:
             return jsonify(ok=False, error="Student not found"), 404
@@ -950,11 +1065,15 @@ def api_roster_clear():
     clear_history = data.get('clear_history', False)
     
     try:
+        # Serialized with roster imports applying for this tenant
+        lock_tenant(user_id)
         StudentName.query.filter_by(user_id=user_id).delete()
         if clear_history:
             # Remove all sessions for this user
             Session.query.filter_by(user_id=user_id).delete()
+            stats_service.clear_rollups(user_id)
             
+        roster_service.bump_generation(user_id)
         db.session.commit()
         refresh_roster_cache(user_id)
         return jsonify(ok=True)
@@ -962,6 +1081,26 @@ def api_roster_clear():
         db.session.rollback()
         return jsonify(ok=False, error=str(e)), 500
 
+def get_session_logs(user_id: Optional[int], limit: int):
+    """Most recent sessions as (session, duration_seconds, status) rows, plus their names.
+
+    Duration and status ("active", "completed" or "overdue") are computed by
+    the database; names are resolved in one batch.
+    """
+    overdue_seconds = get_settings(user_id)["overdue_minutes"] * 60
+    now = now_utc()
+    status = case(
+        (Session.end_ts.is_(None), "active"),
+        (Session.is_overdue(overdue_seconds, now), "overdue"),
+        else_="completed",
+    )
+    rows = db.session.query(Session, Session.duration_at(now), status)\
+        .filter(Session.user_id == user_id)\
+        .order_by(Session.start_ts.desc()).limit(limit).all()
+    ids = list(dict.fromkeys(s.student_id for s, _, _ in rows))
+    names = roster_service.get_student_names(user_id, ids, "Unknown") if ids else {}
+    return rows, names
+
 @app.route("/api/admin/logs", methods=["GET"])
 def api_admin_logs():
     if not is_admin_authenticated():
@@ -970,26 +1109,17 @@ def api_admin_logs():
     user_id = get_current_user_id()
     try:
         # Fetch last 100 sessions
-        sessions = Session.query.filter_by(user_id=user_id).order_by(Session.start_ts.desc()).limit(100).all()
+        rows, names = get_session_logs(user_id, 100)
         
         logs = []
-        for s in sessions:
-            name = get_student_name(s.student_id, "Unknown", user_id=user_id)
-            
-            status = "active"
-            if s.end_ts:
-                status = "completed"
-                # Check if it was overdue
-                if s.duration_seconds > get_settings(user_id)["overdue_minutes"] * 60:
-                    status = "overdue"
-            
+        for s, duration, status in rows:
             logs.append({
                 "id": s.id,
-                "name": name,
+                "name": names.get(s.student_id) or "Unknown",
                 "student_id": s.student_id, # Raw ID might be needed for correlation
                 "start": to_local(s.start_ts).isoformat(),
                 "end": to_local(s.end_ts).isoformat() if s.end_ts else None,
-                "duration_minutes": round(s.duration_seconds / 60, 1),
+                "duration_minutes": round(duration / 60, 1),
                 "status": status,
                 "room": s.room
             })
@@ -1007,27 +1137,20 @@ def api_admin_logs_export():
     try:
         # Fetch all sessions (limited to reasonable number or date range? User said "export logs", implies all)
         # Let's limit to last 1000 for safety, or all if feasible. 1000 is safe.
-        sessions = Session.query.filter_by(user_id=user_id).order_by(Session.start_ts.desc()).limit(1000).all()
+        rows, names = get_session_logs(user_id, 1000)
         
         si = io.StringIO()
         cw = csv.writer(si)
         cw.writerow(["Student Name", "Student ID", "Room", "Start Time", "End Time", "Duration (Minutes)", "Status"])
         
-        for s in sessions:
-            name = get_student_name(s.student_id, "Unknown", user_id=user_id)
-            status = "active"
-            if s.end_ts:
-                status = "completed"
-                if s.duration_seconds > get_settings(user_id)["overdue_minutes"] * 60:
-                    status = "overdue"
-            
+        for s, duration, status in rows:
             cw.writerow([
-                name,
+                names.get(s.student_id) or "Unknown",
                 s.student_id,
                 s.room,
                 to_local(s.start_ts).isoformat(),
                 to_local(s.end_ts).isoformat() if s.end_ts else "",
-                round(s.duration_seconds / 60, 1),
+                round(duration / 60, 1),
                 status
             ])
             
@@ -1054,19 +1177,23 @@ def api_ban_overdue():
     overdue_seconds = settings["overdue_minutes"] * 60
     
     try:
-        # Find active sessions that are overdue
-        open_sessions = Session.query.filter_by(user_id=user_id, end_ts=None).all()
-        count = 0
-        for s in open_sessions:
-            # Check if overdue using duration_seconds property
-            if s.duration_seconds > overdue_seconds:
-                # Find StudentName by hashing the student_id
-                name_hash = hashlib.sha256(f"student_{user_id}_{s.student_id}".encode()).hexdigest()[:16]
-                student_name = StudentName.query.filter_by(user_id=user_id, name_hash=name_hash).first()
-                if student_name and not student_name.banned:
-                    student_name.banned = True
-                    count += 1
+        # Students with an overdue active session, found by the database
+        overdue_ids = [sid for (sid,) in db.session.query(Session.student_id).distinct()
+                       .filter_by(user_id=user_id, end_ts=None).filter(Session.is_overdue(overdue_seconds, now_utc()))]
+        # Their unbanned roster entries, looked up by hash in one query
+        hashes = {roster_service._hash_student_id(sid, user_id): sid for sid in overdue_ids}
+        banned_ids = []
+        if hashes:
+            for student_name in StudentName.query.filter_by(user_id=user_id, banned=False)\
+                    .filter(StudentName.name_hash.in_(list(hashes))):
+                student_name.banned = True
+                banned_ids.append(hashes[student_name.name_hash])
+        count = len(banned_ids)
+        if banned_ids:
+            roster_service.bump_generation(user_id)
         db.session.commit()
+        for student_id in banned_ids:
+            roster_service.update_entry(user_id, student_id, banned=True)
         return jsonify(ok=True, count=count)
     except Exception as e:
         db.session.rollback()
@@ -1080,6 +1207,8 @@ def api_delete_history():
     user_id = get_current_user_id()
     try:
         Session.query.filter_by(user_id=user_id).delete()
+        stats_service.clear_rollups(user_id)
+        notify_tenant(user_id)
         db.session.commit()
         return jsonify(ok=True)
     except Exception as e:
@@ -1128,7 +1257,11 @@ def api_dev_stats():
         active_sessions=Session.query.filter_by(end_ts=None).count(),
         total_students=StudentName.query.count(),
         total_users=User.query.count(),
-        settings=get_settings()
+        settings=get_settings(),
+        request_memo=get_memo_totals(),
+        last_roster_rebuild=roster_service.last_rebuild if roster_service else None,
+        event_streams=status_broadcaster.stats(),
+        event_bus=event_bus.stats()
     )
 
 # ---------- Keep-alive (Render) ----------
@@ -1195,6 +1328,16 @@ def _keep_alive_loop(base_url: str):
             time.sleep(600)
 
 
+@app.after_request
+def _report_request_memo(response):
+    """Report how many tenant lookups the request memo deduplicated."""
+    memo = get_request_memo()
+    if memo is not None and (memo.hits or memo.misses):
+        response.headers['X-Request-Memo'] = f"hits={memo.hits} misses={memo.misses}"
+        record_request_memo(memo)
+    return response
+
+
 @app.before_request
 def _redirect_https():
     """Redirect HTTP to HTTPS in production (Render, etc.)"""
@@ -1219,6 +1362,26 @@ def _start_keepalive_thread():
     t.start()
     _keepalive_started = True
 
+@app.before_request
+def _start_event_bus():
+    """Start this worker's cross-worker event listener (no-op once running)."""
+    event_bus.start()
+
+_roster_imports_resumed = False
+
+@app.before_request
+def _resume_roster_imports():
+    """Once per worker: pick up roster imports left behind by a restarted worker."""
+    global _roster_imports_resumed
+    if _roster_imports_resumed or roster_importer is None:
+        return
+    _roster_imports_resumed = True
+    try:
+        roster_importer.resume_stale()
+    except Exception as e:
+        db.session.rollback()
+        print(f"Roster import resume failed: {e}")
+
 # ---- API ----
 
 @app.post("/api/scan")
@@ -1241,18 +1404,37 @@ def api_scan():
     
     if student_name == "Student":  # Default fallback means student not found
         # Check if roster is actually empty
-        if len(get_memory_roster(user_id)) == 0:
+        if roster_service.get_roster_size(user_id) == 0:
             return jsonify(ok=False, message="Roster empty. Please upload student list."), 404
         else:
             return jsonify(ok=False, message=f"Incorrect ID: {code}"), 404
     
+    # Everything from here on is one transaction, serialized per tenant, so two
+    # kiosks scanning at the same moment can't both see a free slot.
+    try:
+        lock_tenant(user_id)
+        result, status = _apply_scan(user_id, code, student_name, settings)
+        if result.get("ok"):
+            notify_tenant(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify(**result), status
+
+
+def _apply_scan(user_id: Optional[int], code: str, student_name: str, settings: dict):
+    """Scan state machine: end, queue, deny or start a pass.
+
+    Runs inside the caller's locked transaction and never commits; returns
+    (response_body, status_code).
+    """
     # Ensure minimal Student record exists for foreign key constraint
     # (Note: Student table is global in ID, but scoped via user_id FK if we wanted strict separation)
     # Ideally checking existence by ID is enough, but for 2.0 we might want to attach user_id if creating new
-    if not Student.query.get(code):
+    if not db.session.get(Student, code):
         anonymous_student = Student(id=code, name=f"Anonymous_{code}", user_id=user_id)
         db.session.add(anonymous_student)
-        db.session.commit()
 
     open_sessions = get_open_sessions(user_id)
 
@@ -1260,7 +1442,6 @@ def api_scan():
     # Check if auto-ban is enabled and student is overdue BEFORE ending session
     for s in open_sessions:
         if s.student_id == code:
-            # Check if student is overdue and auto-ban is enabled
             # Check if student is overdue and auto-ban is enabled
             action = "ended"
             msg = None
@@ -1269,7 +1450,7 @@ def api_scan():
                 if s.duration_seconds > overdue_seconds:
                     # Auto-ban this student for being overdue
                     if not is_student_banned(code, user_id=user_id):
-                        set_student_banned(code, True, user_id=user_id)
+                        set_student_banned(code, True, user_id=user_id, commit=False)
                         print(f"AUTO-BAN ON SCAN-BACK: {student_name} ({code}) was overdue {round(s.duration_seconds / 60, 1)} minutes")
                         action = "ended_banned"
                         msg = "PASSED RETURNED LATE - AUTO BANNED"
@@ -1277,7 +1458,7 @@ def api_scan():
             # End the session
             s.end_ts = now_utc()
             s.ended_by = "kiosk_scan"
-            db.session.commit()
+            stats_service.record_end(s, settings["overdue_minutes"] * 60)
             
             # ---------------------------
             # AUTO-PROMOTE LOGIC
@@ -1290,47 +1471,41 @@ def api_scan():
                     # Promote them!
                     next_code = next_in_line.student_id
                     
-                    # Start session for ANY capacity (since we just freed one, or config allows)
-                    # Actually, we should check if capacity is available, but since we ended 's', we have -1.
-                    # Wait, if capacity was 1/1, now 0/1. So we can add.
-                    
+                    # We just freed a slot ('s' ended above), so the promoted student fits.
                     promoted_sess = Session(student_id=next_code, start_ts=now_utc(), room=settings["room_name"], user_id=user_id, ended_by="auto")
                     db.session.add(promoted_sess)
                     db.session.delete(next_in_line) # Remove from queue
-                    db.session.commit()
                     
                     next_student_name = get_student_name(next_code, "Student", user_id=user_id)
                     action = "ended_auto_started" # Special action for UI
             
-            return jsonify(ok=True, action=action, message=msg, name=student_name, next_student=next_student_name)
+            return dict(ok=True, action=action, message=msg, name=student_name, next_student=next_student_name), 200
     
     # Check if student is banned from starting NEW restroom trips
     # (They can still end existing trips above)
     if is_student_banned(code, user_id=user_id):
-        return jsonify(ok=False, action="banned", message="RESTROOM PRIVILEGES SUSPENDED - SEE TEACHER", name=student_name), 403
+        return dict(ok=False, action="banned", message="RESTROOM PRIVILEGES SUSPENDED - SEE TEACHER", name=student_name), 403
 
     # ---------------------------
     # QUEUE LOCK LOGIC
     # ---------------------------
     # If queue exists, scanner MUST be at the top to start.
-    queue_count = Queue.query.filter_by(user_id=user_id).count()
-    if queue_count > 0:
-        top_spot = Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).first()
+    queue = get_queue(user_id)
+    if queue:
+        top_spot = queue[0]
         if top_spot.student_id != code:
              # Scanner is NOT the top spot.
              # Check if they are already in queue (somewhere else)
-             if Queue.query.filter_by(user_id=user_id, student_id=code).first():
-                 return jsonify(ok=False, action="denied_queue_position", message="You are in the waitlist. Please wait for your turn (Queue Lock)."), 409
+             if any(q.student_id == code for q in queue):
+                 return dict(ok=False, action="denied_queue_position", message="You are in the waitlist. Please wait for your turn (Queue Lock)."), 409
              else:
                  # New student trying to cut in line
                  # If Queue is enabled, auto-join them to the BACK.
                  if settings.get("enable_queue"):
-                     q = Queue(student_id=code, user_id=user_id)
-                     db.session.add(q)
-                     db.session.commit()
-                     return jsonify(ok=True, action="queued", message="Added to Waitlist (Queue is active)")
+                     db.session.add(Queue(student_id=code, user_id=user_id))
+                     return dict(ok=True, action="queued", message="Added to Waitlist (Queue is active)"), 200
                  else:
-                     return jsonify(ok=False, action="denied", message="Waitlist is active. Cannot start."), 409
+                     return dict(ok=False, action="denied", message="Waitlist is active. Cannot start."), 409
         else:
             # Scanner IS the top spot. Allow and REMOVE from queue.
             db.session.delete(top_spot)
@@ -1340,31 +1515,19 @@ def api_scan():
     # CAPACITY CHECK & START
     # ---------------------------
     if len(open_sessions) >= settings["capacity"]:
-         # Queue Prompt / Auto-Join (Fail-safe for non-queue setups or race conditions)
-         # Check if already in Queue (already checked above if queue>0, but if queue=0 and now full?)
-         existing_q = Queue.query.filter_by(user_id=user_id, student_id=code).first()
-         if existing_q:
-              return jsonify(ok=False, action="denied_queue_position", message="You are in the waitlist."), 409
-         
+         # Queue Prompt / Auto-Join (queue was empty, but every slot is taken)
          if settings.get("enable_queue"):
              # Auto-Join Queue
-             q = Queue(student_id=code, user_id=user_id)
-             db.session.add(q)
-             db.session.commit()
-             return jsonify(ok=True, action="queued", message="Added to Waitlist")
+             db.session.add(Queue(student_id=code, user_id=user_id))
+             return dict(ok=True, action="queued", message="Added to Waitlist"), 200
          else:
              # Queue Disabled - Deny
-             return jsonify(ok=False, action="denied", message="Pass limit reached."), 409
+             return dict(ok=False, action="denied", message="Pass limit reached."), 409
 
     # Otherwise start a new session
-    # (Cleanup: Ensure not in queue if we reached here? logic above handles top_spot delete)
-    # Double check just in case (e.g. queue was 0, but race condition?)
-    Queue.query.filter_by(user_id=user_id, student_id=code).delete()
-    
     sess = Session(student_id=code, start_ts=now_utc(), room=settings["room_name"], user_id=user_id)
     db.session.add(sess)
-    db.session.commit()
-    return jsonify(ok=True, action="started", name=student_name)
+    return dict(ok=True, action="started", name=student_name), 200
 
 @app.route("/api/queue/join", methods=["POST"])
 def api_queue_join():
@@ -1381,6 +1544,7 @@ def api_queue_join():
         
     q = Queue(student_id=code, user_id=user_id)
     db.session.add(q)
+    notify_tenant(user_id)
     db.session.commit()
     return jsonify(ok=True)
 
@@ -1392,6 +1556,7 @@ def api_queue_leave():
     user_id = get_current_user_id(token)
 
     Queue.query.filter_by(user_id=user_id, student_id=code).delete()
+    notify_tenant(user_id)
     db.session.commit()
     return jsonify(ok=True)
 
@@ -1406,6 +1571,7 @@ def api_queue_delete():
         return jsonify(ok=False, error="Missing student_id"), 400
 
     Queue.query.filter_by(user_id=user_id, student_id=student_id).delete()
+    notify_tenant(user_id)
     db.session.commit()
     return jsonify(ok=True)
 
@@ -1413,70 +1579,82 @@ def api_queue_delete():
 def api_status():
     token = request.args.get('token')
     user_id = get_current_user_id(token)
-    settings = get_settings(user_id)
-    
-    s = get_current_holder(user_id)
-    overdue_minutes = settings["overdue_minutes"]
-    kiosk_suspended = settings["kiosk_suspended"]
-    auto_ban_overdue = settings.get("auto_ban_overdue", False)
 
-    auto_promote_queue = settings.get("auto_promote_queue", False)
-    enable_queue = settings.get("enable_queue", False)
-    
-    if s:
-        is_overdue = s.duration_seconds > overdue_minutes * 60
-        
-        # FERPA Compliance: Get name from session or memory roster
-        student_name = get_student_name(s.student_id, "Student", user_id=user_id)
-        
-        return jsonify(
-            in_use=True, 
-            name=student_name, 
-            start=to_local(s.start_ts).isoformat(), 
-            elapsed=s.duration_seconds, 
-            overdue=is_overdue, 
-            overdue_minutes=overdue_minutes, 
-            kiosk_suspended=kiosk_suspended, 
-            auto_ban_overdue=auto_ban_overdue,
-            auto_promote_queue=auto_promote_queue,
-            # Multi-pass support
-            capacity=settings["capacity"],
-            active_sessions=[{
-                "id": sess.id,
-                "name": get_student_name(sess.student_id, "Student", user_id=user_id),
-                "elapsed": sess.duration_seconds,
-                "overdue": sess.duration_seconds > overdue_minutes * 60,
-                "start": to_local(sess.start_ts).isoformat()
-            } for sess in get_open_sessions(user_id)],
-            # Queue data
-            queue=[get_student_name(q.student_id, "Unknown", user_id=user_id) 
-                   for q in Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()],
-            queue_list=[{
-                "name": get_student_name(q.student_id, "Unknown", user_id=user_id),
-                "student_id": q.student_id  # Encrypted/ID - wait, local DB uses ID. 
-                # If encryption enabled, student_id is encrypted? No, Queue stores `code`.
-                # If code is encrypted ID, then yes.
-                # However, api_queue_delete expects `student_id`.
-                # We should return what is stored in Queue.student_id.
-            } for q in Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()]
-        )
-    else:
-        return jsonify(
-            in_use=False, 
-            overdue_minutes=overdue_minutes, 
-            kiosk_suspended=kiosk_suspended, 
-            auto_ban_overdue=auto_ban_overdue,
-            auto_promote_queue=auto_promote_queue,
-             # Multi-pass support
-             capacity=settings["capacity"],
-            active_sessions=[],
-            queue=[get_student_name(q.student_id, "Unknown", user_id=user_id) 
-                   for q in Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()],
-            queue_list=[{
-                "name": get_student_name(q.student_id, "Unknown", user_id=user_id),
-                "student_id": q.student_id
-            } for q in Queue.query.filter_by(user_id=user_id).order_by(Queue.joined_ts.asc()).all()]
-        )
+    # Read the version before building the body: a change committed in between
+    # makes the body newer than its tag (one extra 200 later), never older.
+    version = get_state_version(user_id)
+    now = now_utc()
+    # School hours are part of the tag too: poll_interval depends on them
+    in_hours = _should_ping_now(now.astimezone(TZ))
+    etag = None
+    if version is not None:
+        # So are the overdue flags, which flip with time rather than with the version
+        overdue = status_service.overdue_count(user_id, version, now)
+        etag = f"{user_id}.{version}.{'h' if in_hours else 'o'}.{overdue}"
+        if request.if_none_match.contains_weak(etag):
+            not_modified = Response(status=304)
+            not_modified.set_etag(etag, weak=True)
+            not_modified.headers["Cache-Control"] = "no-store"
+            return not_modified
+
+    snapshot = status_service.snapshot(user_id, version)
+    response = jsonify(poll_interval=recommended_poll_interval(snapshot, in_hours), **snapshot.to_status(now))
+    if etag is not None:
+        # Weak and never stored by the browser: only clients that send
+        # If-None-Match themselves (and derive elapsed time) get 304s
+        response.set_etag(etag, weak=True)
+        response.headers["Cache-Control"] = "no-store"
+    return response
+
+def recommended_poll_interval(snapshot, in_hours: bool) -> float:
+    """Seconds a client should wait before polling /api/status again"""
+    if snapshot.settings["kiosk_suspended"] or not in_hours:
+        return config.POLL_DORMANT_SECONDS
+    if snapshot.sessions or snapshot.queue:
+        return config.POLL_ACTIVE_SECONDS
+    return config.POLL_IDLE_SECONDS
+
+def get_state_version(user_id: Optional[int]) -> Optional[int]:
+    """A tenant's state_version: the basis of the weak validator for its
+    /api/status body (None when untracked).
+
+    elapsed and server_time are left out on purpose: clients that revalidate
+    derive elapsed time from start/overdue_at and their clock offset, which a
+    304 keeps valid. The overdue flags are added to the tag separately.
+    """
+    if user_id is None:
+        return None
+    return db.session.query(Settings.state_version).filter_by(user_id=user_id).scalar()
+
+def stamp_server_time(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """Add the server clock so clients can correct for skew when computing elapsed time."""
+    return dict(payload, server_time=now_utc().isoformat())
+
+def build_event_status(user_id: Optional[int]) -> Dict[str, Any]:
+    """Status payload pushed to /events subscribers (built once per tenant per tick).
+    server_time is stamped on at send time."""
+    return status_service.snapshot(user_id).to_event()
+
+# One shared status poller per tenant with open /events streams (per worker),
+# woken immediately by change events from any worker
+status_broadcaster = StatusBroadcaster(app, db, build_event_status, stamp=stamp_server_time,
+                                       history_size=config.EVENTS_REPLAY_SIZE,
+                                       linger=config.EVENTS_LINGER_SECONDS,
+                                       heartbeat=config.EVENTS_HEARTBEAT_SECONDS)
+
+def _on_status_event(user_id: Optional[int]) -> None:
+    if status_service is not None:
+        status_service.invalidate(user_id)
+
+# Drop the cached snapshot before waking the broadcaster, so it rebuilds
+event_bus.subscribe(STATUS, _on_status_event)
+event_bus.subscribe(STATUS, status_broadcaster.wake)
+
+def _on_roster_event(user_id: Optional[int]) -> None:
+    if roster_service is not None:
+        roster_service.expire_generation(user_id)
+
+event_bus.subscribe(ROSTER, _on_roster_event, remote_only=True)
 
 @app.get("/events")
 def sse_events():
@@ -1484,165 +1662,107 @@ def sse_events():
     # Capture user_id at start of stream
     user_id = get_current_user_id(token)
     
-    def stream():
-        last_payload = None
-        while True:
-            # We must use proper application context inside generator if accessing DB lazily, 
-            # but here we just call helpers which usually should be fine if app context is pushed.
-            # However, stream_with_context handles the context.
-            
-            # End current transaction and start fresh to see committed changes from other connections
-            # (PostgreSQL transaction isolation prevents seeing uncommitted data)
-            db.session.rollback()
-            
-            settings = get_settings(user_id)
-            
-            s = get_current_holder(user_id)
-            overdue_minutes = settings["overdue_minutes"]
-            kiosk_suspended = settings["kiosk_suspended"]
-            auto_ban_overdue = settings.get("auto_ban_overdue", False)
-            auto_promote_queue = settings.get("auto_promote_queue", False)
-            if s:
-                student_name = get_student_name(s.student_id, "Student", user_id=user_id)
-                payload = {
-                    "in_use": True,
-                    "name": student_name,
-                    "elapsed": s.duration_seconds,
-                    "overdue": s.duration_seconds > overdue_minutes * 60,
-                    "overdue_minutes": overdue_minutes,
-                    "kiosk_suspended": kiosk_suspended,
-                    "auto_ban_overdue": auto_ban_overdue,
-                    "auto_promote_queue": auto_promote_queue,
-                    "capacity": settings["capacity"],
-                    "active_sessions": [{
-                        "id": sess.id,
-                        "name": get_student_name(sess.student_id, "Student", user_id=user_id),
-                        "elapsed": sess.duration_seconds,
-                        "overdue": sess.duration_seconds > overdue_minutes * 60,
-                        "start": to_local(sess.start_ts).isoformat()
-                    } for sess in get_open_sessions(user_id)]
-                }
-            else:
-                payload = {
-                    "in_use": False, 
-                    "overdue_minutes": overdue_minutes, 
-                    "kiosk_suspended": kiosk_suspended, 
-                    "auto_ban_overdue": auto_ban_overdue,
-                    "auto_promote_queue": auto_promote_queue,
-                    "capacity": settings["capacity"],
-                    "active_sessions": []
-                }
-            if payload != last_payload:
-                yield f"data: {json.dumps(payload)}\n\n"
-                last_payload = payload
-            time.sleep(1)
-    return Response(stream_with_context(stream()), mimetype="text/event-stream")
+    # Browsers resend the last frame's id when EventSource reconnects
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    # The tenant's broadcaster does the database work once per tick for every
+    # subscriber; the stream itself holds no app context or DB connection.
+    return Response(status_broadcaster.listen(user_id, last_event_id), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache"})
 
 @app.get("/api/stats")
 def api_stats():
-    """Simple stats: today's hourly counts and last 7 days daily counts."""
+    """Simple stats: today's hourly counts and daily counts for the last `days` days (default 7)."""
     user_id = get_current_user_id()
     today_local = datetime.now(TZ).date()
-    start_today = datetime.combine(today_local, datetime.min.time(), tzinfo=TZ).astimezone(timezone.utc)
-    end_today = datetime.combine(today_local, datetime.max.time(), tzinfo=TZ).astimezone(timezone.utc)
-    
-    query = Session.query.filter(Session.start_ts >= start_today, Session.start_ts <= end_today)
-    if user_id is not None:
-        query = query.filter_by(user_id=user_id)
-        
-    rows_today = query.all()
-
-    hourly = [0]*24
-    for r in rows_today:
-        h = r.start_ts.astimezone(TZ).hour
-        hourly[h] += 1
-
-    # last 7 days including today
-    daily_labels = []
-    daily_counts = []
-    for i in range(6, -1, -1):
-        day = today_local - timedelta(days=i)
-        ds = datetime.combine(day, datetime.min.time(), tzinfo=TZ).astimezone(timezone.utc)
-        de = datetime.combine(day, datetime.max.time(), tzinfo=TZ).astimezone(timezone.utc)
-        
-        q = Session.query.filter(Session.start_ts >= ds, Session.start_ts <= de)
-        if user_id is not None:
-            q = q.filter_by(user_id=user_id)
-            
-        c = q.count()
-        daily_labels.append(day.strftime("%a"))
-        daily_counts.append(c)
+    try:
+        days = min(max(int(request.args.get("days", 7)), 1), config.STATS_MAX_DAYS)
+    except ValueError:
+        days = 7
+
+    # One grouped query per series, however many days are requested
+    hourly = stats_service.hourly_counts(user_id, today_local)
+    daily = stats_service.daily_counts(user_id, today_local - timedelta(days=days - 1), today_local)
 
     return jsonify({
         "hourly": hourly,
-        "daily_labels": daily_labels,
-        "daily_counts": daily_counts,
+        "daily_labels": [day.strftime("%a") for day in daily],
+        "daily_dates": [day.isoformat() for day in daily],
+        "daily_counts": list(daily.values()),
     })
 
+# Named windows for /api/stats/week (days, including today)
+STATS_WINDOWS = {"week": 7, "month": 30, "term": config.STATS_TERM_DAYS}
+
 @app.get("/api/stats/week")
 def api_stats_week():
-    """Weekly, per-student focus: counts and overdues (last 7 days including today)."""
+    """Per-student focus: counts and overdues over a window (?window=week|month|term
+    or ?days=N; default the last 7 days including today)."""
     user_id = get_current_user_id()
     settings = get_settings(user_id)
     overdue_minutes = settings["overdue_minutes"]
-    now = now_utc()
-    start_utc = (datetime.now(TZ).date() - timedelta(days=6))
-    start_utc = datetime.combine(start_utc, datetime.min.time(), tzinfo=TZ).astimezone(timezone.utc)
-    
-    query = Session.query.filter(Session.start_ts >= start_utc)
-    if user_id is not None:
-        query = query.filter_by(user_id=user_id)
-        
-    rows = query.all()
-
-    per_student = {}
-    for r in rows:
-        sid = r.student_id
-        # Prefer roster name over Student table name (fixes Anonymous entries)
-        name = get_student_name(sid, "Unknown", user_id=user_id)
-        if name == "Unknown" and r.student and r.student.name != "Student":
-            name = r.student.name
-        if sid not in per_student:
-            per_student[sid] = {"name": name, "count": 0, "overdue": 0}
-        per_student[sid]["count"] += 1
-        end = r.end_ts or now
-        duration = int((end - r.start_ts).total_seconds())
-        if duration > overdue_minutes * 60:
-            per_student[sid]["overdue"] += 1
-
-    # top by count
-    top_usage = sorted(per_student.values(), key=lambda x: x["count"], reverse=True)[:10]
-    # top by overdue absolute
-    top_overdue = sorted(per_student.values(), key=lambda x: x["overdue"], reverse=True)[:10]
-    # top by overdue rate (only if count >= 1)
-    for v in per_student.values():
-        v["overdue_rate"] = (v["overdue"] / v["count"]) if v["count"] else 0
-    top_overdue_rate = sorted(per_student.values(), key=lambda x: x["overdue_rate"], reverse=True)[:10]
+    today_local = datetime.now(TZ).date()
+    window = request.args.get("window", "week")
+    try:
+        days = int(request.args["days"]) if "days" in request.args else STATS_WINDOWS[window]
+    except (KeyError, ValueError):
+        return jsonify(ok=False, error=f"Unknown window: {window}"), 400
+    days = min(max(days, 1), config.STATS_MAX_DAYS)
+    try:
+        limit = min(max(int(request.args.get("limit", 10)), 1), 100)
+    except ValueError:
+        limit = 10
+
+    # One GROUP BY for every student's count and overdue count
+    usage = stats_service.student_usage(user_id, today_local - timedelta(days=days - 1), today_local,
+                                        overdue_minutes * 60, now_utc())
+    top_usage = stats_service.top(usage, "count", limit)
+    top_overdue = stats_service.top(usage, "overdue", limit)
+    top_overdue_rate = stats_service.top(usage, "overdue_rate", limit)
+
+    # Names only for students that made a top list, in one batch
+    ids = list(dict.fromkeys(r["student_id"] for r in top_usage + top_overdue + top_overdue_rate))
+    names = get_student_names(ids, "Unknown", user_id=user_id)
+
+    def name(row):
+        return names.get(row["student_id"], "Unknown")
 
     def pack(arr):
-        return {"labels": [a["name"] for a in arr], "values": [a["count"] for a in arr], "overdues": [a["overdue"] for a in arr], "rates": [round(a.get("overdue_rate", 0)*100, 1) for a in arr]}
+        return {"labels": [name(a) for a in arr], "values": [a["count"] for a in arr], "overdues": [a["overdue"] for a in arr], "rates": [round(a["overdue_rate"]*100, 1) for a in arr]}
 
     return jsonify({
         "top_usage": pack(top_usage),
         "top_overdue": pack(top_overdue),
         "top_overdue_rate": {
-            "labels": [a["name"] for a in top_overdue_rate],
+            "labels": [name(a) for a in top_overdue_rate],
             "values": [a["overdue"] for a in top_overdue_rate],
             "rates": [round(a["overdue_rate"]*100, 1) for a in top_overdue_rate],
         },
         "overdue_minutes": overdue_minutes,
+        "days": days,
     })
 
 @app.post("/api/override_end")
 @require_admin_auth_api
 def api_override_end():
     user_id = get_current_user_id()
-    s = get_current_holder(user_id)
+    overdue_seconds = get_settings(user_id)["overdue_minutes"] * 60
+    # Serialized with scans like /api/scan, so a scan-back can't end (and
+    # count into the rollup) the same pass at the same moment
+    try:
+        lock_tenant(user_id)
+        s = get_current_holder(user_id)
+        if s:
+            s.end_ts = now_utc()
+            s.ended_by = "override"
+            stats_service.record_end(s, overdue_seconds)
+            notify_tenant(user_id)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
     if not s:
         return jsonify(ok=False, message="No one is out."), 400
-    s.end_ts = now_utc()
-    s.ended_by = "override"
-    db.session.commit()
     return jsonify(ok=True)
 
 
@@ -1664,22 +1784,13 @@ def api_toggle_kiosk_suspend_quick():
         # Get or create settings for this user
         s = Settings.query.filter_by(user_id=user_id).first()
         if not s:
-            s = Settings(
-                user_id=user_id,
-                room_name="Hall Pass",
-                capacity=1,
-                overdue_minutes=10,
-                kiosk_suspended=True,
-                auto_ban_overdue=False,
-                auto_promote_queue=False
-            )
-            db.session.add(s)
+            s = settings_service.get_row(user_id, kiosk_suspended=True, auto_promote_queue=False)
             new_state = True
         else:
             s.kiosk_suspended = not s.kiosk_suspended
             new_state = s.kiosk_suspended
         
-        db.session.commit()
+        settings_service.commit(user_id, s)
         return jsonify(ok=True, suspended=new_state, message=f"Kiosk {'suspended' if new_state else 'resumed'}")
     except Exception as e:
         db.session.rollback()
@@ -1811,51 +1922,28 @@ def api_auto_ban_overdue():
 def api_upload_session_roster():
     """Upload student roster to database (encrypted) for persistent access."""
     try:
-        user_id = get_current_user_id()
         if "file" not in request.files:
             return jsonify(ok=False, message="No file uploaded"), 400
         
         f = request.files["file"]
         if not f or f.filename == '':
             return jsonify(ok=False, message="No file selected"), 400
-            
-        text = f.stream.read().decode("utf-8", errors="ignore")
-        reader = csv.reader(io.StringIO(text))
-        
-        student_roster = {}
-        count = 0
-        
-        # Clear existing memory roster to force refresh
-        clear_memory_roster(user_id)
         
         # We don't clear the DB first - we upsert/add. 
         # If user wants to clear, they should use the clear endpoint first.
+        # The import also retroactively names any "Anonymous_ID" entries.
+        job = start_roster_import(MERGE, f)
+        if job.status == FAILED:
+            return jsonify(ok=False, job_id=job.id, message=f"Upload failed: {job.error}"), 500
+        if job.status != COMPLETE:
+            return roster_import_accepted(job)
         
-        for row in reader:
-            if not row or len(row) < 2:
-                continue
-            sid, name = row[0].strip(), row[1].strip()
-            if not sid or not name:
-                continue
-            student_roster[sid] = name
-            count += 1
-        
-        # Store all students in DB using efficient batch method (single commit)
-        db_stored = roster_service.store_student_names_batch(user_id, student_roster)
-        
-        # Populate memory cache for immediate performance
-        set_memory_roster(student_roster, user_id)
-        
-        # Update any Anonymous students with real names from the roster
-        # This global update needs review for multi-tenancy as Student table is mixed
-        
-        # Retroactively update any "Anonymous_ID" entries in database
-        updated_count = roster_service.update_anonymous_students(user_id, Student)
-            
+        result = roster_importer.progress(job)["result"]
+        count, updated_count = result["count"], result.get("updated_anonymous", 0)
         msg = f"Roster uploaded successfully ({count} students)."
         if updated_count > 0:
             msg += f" Updated {updated_count} previously anonymous entries."
-        return jsonify(ok=True, imported=count, updated_anonymous=updated_count, message=msg)
+        return jsonify(ok=True, job_id=job.id, imported=count, updated_anonymous=updated_count, message=msg)
         
     except Exception as e:
         return jsonify(ok=False, message=f"Upload failed: {str(e)}"), 500
@@ -1865,11 +1953,11 @@ def api_upload_session_roster():
 def api_get_memory_roster_status():
     """Get memory roster status for admin display"""
     user_id = get_current_user_id()
-    memory_roster = get_memory_roster(user_id)
+    roster_size = roster_service.get_roster_size(user_id)
     
     status = {
-        'count': len(memory_roster),
-        'active': len(memory_roster) > 0,
+        'count': roster_size,
+        'active': roster_size > 0,
     }
     
     return jsonify(ok=True, **status)
@@ -1880,6 +1968,8 @@ def api_clear_session_roster():
     """Clear memory and database roster."""
     user_id = get_current_user_id()
     clear_memory_roster(user_id)
+    # Held until clear_all_student_names commits, like /api/roster/clear
+    lock_tenant(user_id)
     roster_service.clear_all_student_names(user_id)
     return jsonify(ok=True, message="All rosters cleared")
 
@@ -1899,10 +1989,13 @@ def api_reset_database():
         if user_id is not None:
              # Scope delete to user
              total_sessions = Session.query.filter_by(user_id=user_id).delete()
+             stats_service.clear_rollups(user_id)
         else:
              # Legacy global wipe
              total_sessions = Session.query.delete()
-             
+             SessionDailyRollup.query.delete()
+        
+        notify_tenant(user_id)
         db.session.commit()
 
         return jsonify(
@@ -1931,9 +2024,13 @@ def export_csv():
     start = datetime.combine(today_local, datetime.min.time(), tzinfo=TZ).astimezone(timezone.utc)
     end = datetime.combine(today_local, datetime.max.time(), tzinfo=TZ).astimezone(timezone.utc)
 
-    query = Session.query.filter(Session.start_ts >= start, Session.start_ts <= end)
+    settings = get_settings(user_id)
+    overdue_seconds = settings["overdue_minutes"] * 60
+
+    query = db.session.query(Session, Session.is_overdue(overdue_seconds, now_utc()))\
+        .filter(Session.start_ts >= start, Session.start_ts <= end)
     if user_id is not None:
-        query = query.filter_by(user_id=user_id)
+        query = query.filter(Session.user_id == user_id)
         
     rows = query.order_by(Session.start_ts.asc()).all()
 
@@ -1941,15 +2038,10 @@ def export_csv():
     w = csv.writer(out)
     w.writerow(["student_id", "name", "start_local", "end_local", "duration_seconds", "ended_by", "overdue"])
     
-    settings = get_settings(user_id)
-    overdue_minutes = settings["overdue_minutes"]
-    
-    for r in rows:
+    for r, is_overdue in rows:
         start_local = r.start_ts.astimezone(TZ).strftime("%Y-%m-%d %H:%M:%S")
         end_local = r.end_ts.astimezone(TZ).strftime("%Y-%m-%d %H:%M:%S") if r.end_ts else ""
-        duration = r.duration_seconds if r.end_ts else int((now_utc() - r.start_ts).total_seconds())
-        is_overdue = duration > overdue_minutes * 60
-        w.writerow([r.student_id, r.student.name, start_local, end_local, duration if r.end_ts else "", r.ended_by or "", "YES" if is_overdue else "NO"])
+        w.writerow([r.student_id, r.student.name, start_local, end_local, r.duration_seconds if r.end_ts else "", r.ended_by or "", "YES" if is_overdue else "NO"])
     out.seek(0)
 
     return send_file(
@@ -1993,6 +2085,7 @@ def api_set_kiosk_slug():
         # Update user
         user = User.query.get(user_id)
         user.kiosk_slug = slug
+        invalidate_kiosk_token_cache(user)
         db.session.commit()
         
         return jsonify(ok=True, slug=slug, message="Kiosk URL updated successfully")
@@ -2065,6 +2158,29 @@ def init_db():
     print("Database initialized successfully.")
 
 
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups():
+    """Recompute the session daily rollup from session history (backfill/repair)."""
+    print(f"Rebuilt {rebuild_session_rollups()} rollup rows.")
+
+
+def rebuild_session_rollups() -> int:
+    """Rebuild every tenant's rollup, one transaction per tenant; returns rows written.
+
+    Historical passes are judged against each tenant's current overdue threshold.
+    """
+    total = 0
+    user_ids = [uid for (uid,) in db.session.query(Session.user_id).distinct()]
+    for uid in user_ids:
+        try:
+            total += stats_service.rebuild_rollups(uid, get_settings(uid)["overdue_minutes"] * 60)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"Rollup rebuild for user {uid} failed: {e}")
+    return total
+
+
 def run_migrations():
     """Perform schema migrations and return log messages.
 
@@ -2444,6 +2560,37 @@ def run_migrations():
     except Exception as e:
         messages.append(f"Warning: constraint migration: {e}")
 
+    # Migration 9: Cache/versioning columns (NOT NULL with defaults so existing rows stay valid)
+    cache_columns = [
+        ("settings", "version", "INTEGER NOT NULL DEFAULT 0"),
+        ("settings", "roster_generation", "INTEGER NOT NULL DEFAULT 0"),
+        ("settings", "state_version", "INTEGER NOT NULL DEFAULT 0"),
+    ]
+    
+    for table_name, column_name, column_type in cache_columns:
+        try:
+            res = db.session.execute(text(f"""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = '{table_name}' AND column_name = '{column_name}'
+            """))
+            if res.scalar() is None:
+                messages.append(f"Adding {column_name} to {table_name}")
+                try:
+                    db.session.rollback()
+                except Exception:
+                    pass
+                with db.engine.begin() as conn:
+                    conn.execute(text(f'ALTER TABLE "{table_name}" ADD COLUMN IF NOT EXISTS {column_name} {column_type}'))
+                messages.append(f"Added {column_name} to {table_name}")
+            else:
+                messages.append(f"{column_name} column already exists in {table_name}")
+        except Exception as e:
+            try:
+                db.session.rollback()
+            except Exception:
+                pass
+            messages.append(f"{table_name} column {column_name}: {e}")
+
     return messages
 
 
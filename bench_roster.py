@@ -0,0 +1,51 @@
+"""
+Benchmark RosterService.store_student_names_batch against a scratch SQLite database.
+
+Usage: python bench_roster.py [size ...]   (default sizes: 100 500 2000 5000)
+
+For each roster size it reports the number of SQL statements and the wall
+time for a fresh import (all inserts) and a re-import (all updates).
+"""
+import os
+import sys
+import tempfile
+import time
+
+_db_path = os.path.join(tempfile.mkdtemp(prefix="hallpass-bench-"), "bench.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{_db_path}"
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, db, User, StudentName, initialize_database_if_needed  # noqa: E402
+import app as hallpass  # noqa: E402
+
+
+def main(sizes):
+    initialize_database_if_needed()
+    statements = [0]
+
+    with app.app_context():
+        @event.listens_for(db.engine, "before_cursor_execute")
+        def _count(*_args):
+            statements[0] += 1
+
+        print(f"{'size':>6} {'run':>8} {'queries':>8} {'seconds':>8}")
+        for n, size in enumerate(sizes):
+            user = User(google_id=f"bench-{n}", email=f"bench{n}@example.com", name="Bench")
+            db.session.add(user)
+            db.session.commit()
+            roster = {str(100000 + i): f"Student {i}" for i in range(size)}
+
+            for run in ("insert", "update"):
+                statements[0] = 0
+                started = time.perf_counter()
+                hallpass.roster_service.store_student_names_batch(user.id, roster)
+                elapsed = time.perf_counter() - started
+                print(f"{size:>6} {run:>8} {statements[0]:>8} {elapsed:>8.3f}")
+
+            StudentName.query.filter_by(user_id=user.id).delete()
+            db.session.commit()
+
+
+if __name__ == "__main__":
+    main([int(a) for a in sys.argv[1:]] or [100, 500, 2000, 5000])
@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 # App configuration with environment variable support
 CAPACITY = int(os.getenv("HALLPASS_CAPACITY", "1"))  # How many students can be out at once
@@ -8,6 +9,28 @@ TIMEZONE = os.getenv("HALLPASS_TIMEZONE", "America/Chicago")  # For display and
 SECRET_KEY = os.getenv("HALLPASS_SECRET_KEY", "change-me-in-production")  # Flask session key
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///instance/hallpass.db")  # Use relative path for local dev
 
+# In-process caches (per gunicorn worker)
+TOKEN_CACHE_TTL = int(os.getenv("HALLPASS_TOKEN_CACHE_TTL", "60"))  # Seconds a kiosk token -> user lookup is trusted
+TOKEN_CACHE_SIZE = int(os.getenv("HALLPASS_TOKEN_CACHE_SIZE", "2048"))  # Max cached kiosk tokens/slugs
+SETTINGS_CACHE_TTL = float(os.getenv("HALLPASS_SETTINGS_CACHE_TTL", "2"))  # Seconds before cached settings re-check their version
+UNKNOWN_CODE_TTL = float(os.getenv("HALLPASS_UNKNOWN_CODE_TTL", "30"))  # Seconds an unknown barcode skips the database
+ROSTER_GENERATION_CHECK = float(os.getenv("HALLPASS_ROSTER_CHECK_SECONDS", "2"))  # How often workers check for roster changes made elsewhere
+ROSTER_IMPORT_CHUNK_SIZE = int(os.getenv("HALLPASS_ROSTER_IMPORT_CHUNK", "1000"))  # CSV rows parsed, encrypted and committed per import checkpoint
+ROSTER_IMPORT_WAIT = float(os.getenv("HALLPASS_ROSTER_IMPORT_WAIT", "5"))  # Seconds an upload request waits before answering 202 with a job id
+ROSTER_IMPORT_STALE_SECONDS = float(os.getenv("HALLPASS_ROSTER_IMPORT_STALE", "60"))  # Heartbeat age after which another worker resumes an import
+ROSTER_IMPORT_UPLOAD_CHUNK = int(os.getenv("HALLPASS_ROSTER_IMPORT_UPLOAD_CHUNK", "262144"))  # Upload bytes read, encrypted and stored at a time
+EVENT_TRANSPORT = os.getenv("HALLPASS_EVENT_TRANSPORT", "auto")  # Cross-worker change events: auto, postgres, socket or local
+EVENT_SOCKET_DIR = os.getenv("HALLPASS_EVENT_SOCKET_DIR", os.path.join(tempfile.gettempdir(), "hallpass-events"))  # Shared directory for the socket transport
+STATUS_SNAPSHOT_TTL = float(os.getenv("HALLPASS_STATUS_SNAPSHOT_TTL", "0.5"))  # Seconds a tenant's status snapshot is shared between polls
+EVENTS_REPLAY_SIZE = int(os.getenv("HALLPASS_EVENTS_REPLAY", "64"))  # Recent /events frames kept per tenant for Last-Event-ID replay
+EVENTS_LINGER_SECONDS = float(os.getenv("HALLPASS_EVENTS_LINGER", "30"))  # Seconds a tenant's frames keep being recorded after its last stream drops
+EVENTS_HEARTBEAT_SECONDS = float(os.getenv("HALLPASS_EVENTS_HEARTBEAT", "15"))  # Idle seconds before a stream sends a keep-alive comment
+POLL_ACTIVE_SECONDS = float(os.getenv("HALLPASS_POLL_ACTIVE", "2"))  # Suggested /api/status poll interval while someone is out or queued
+POLL_IDLE_SECONDS = float(os.getenv("HALLPASS_POLL_IDLE", "10"))  # Suggested poll interval when nobody is out during school hours
+POLL_DORMANT_SECONDS = float(os.getenv("HALLPASS_POLL_DORMANT", "60"))  # Suggested poll interval when suspended or outside school hours
+STATS_MAX_DAYS = int(os.getenv("HALLPASS_STATS_MAX_DAYS", "366"))  # Longest window /api/stats will aggregate
+STATS_TERM_DAYS = int(os.getenv("HALLPASS_STATS_TERM_DAYS", "120"))  # Days covered by /api/stats/week?window=term
+
 # Google OAuth Configuration (for 2.0 multi-user support)
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET", "")
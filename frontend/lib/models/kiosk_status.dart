@@ -12,6 +12,9 @@ class KioskStatus {
   final List<Session> activeSessions;
   final List<String> queue;
 
+  /// How long the server suggests waiting before the next poll
+  final Duration? pollInterval;
+
   KioskStatus({
     required this.inUse,
     required this.name,
@@ -23,15 +26,26 @@ class KioskStatus {
     required this.capacity,
     required this.activeSessions,
     required this.queue,
+    this.pollInterval,
   });
 
   factory KioskStatus.fromJson(Map<String, dynamic> json) {
+    // Server clock reference: lets elapsed times be computed locally
+    final serverTime = DateTime.tryParse(json['server_time'] ?? '');
+    final clockOffset = serverTime != null
+        ? serverTime.difference(DateTime.now())
+        : Duration.zero;
+
     var rawSessions = json['active_sessions'] as List?;
     List<Session> sessions = [];
     if (rawSessions != null) {
-      sessions = rawSessions.map((s) => Session.fromJson(s)).toList();
+      sessions = rawSessions
+          .map((s) => Session.fromJson(s, clockOffset: clockOffset))
+          .toList();
     }
 
+    final start = DateTime.tryParse(json['start'] ?? '');
+
     var rawQueue = json['queue'] as List?;
     List<String> queueList = [];
     if (rawQueue != null) {
@@ -41,7 +55,9 @@ class KioskStatus {
     return KioskStatus(
       inUse: json['in_use'] ?? false,
       name: json['name'] ?? '',
-      elapsed: json['elapsed'] is int ? json['elapsed'] : 0,
+      elapsed: start != null
+          ? DateTime.now().add(clockOffset).difference(start).inSeconds
+          : (json['elapsed'] is int ? json['elapsed'] : 0),
       overdue: json['overdue'] ?? false,
       overdueMinutes: json['overdue_minutes'] is int
           ? json['overdue_minutes']
@@ -51,6 +67,9 @@ class KioskStatus {
       capacity: json['capacity'] is int ? json['capacity'] : 1,
       activeSessions: sessions,
       queue: queueList,
+      pollInterval: json['poll_interval'] is num
+          ? Duration(milliseconds: ((json['poll_interval'] as num) * 1000).round())
+          : null,
     );
   }
 }
@@ -1,27 +1,44 @@
 class Session {
   final int id;
   final String name;
-  final int elapsed;
   final bool overdue;
   final DateTime start;
+  final DateTime? overdueAt;
+
+  /// Server clock minus local clock, from the payload's server_time.
+  final Duration clockOffset;
 
   Session({
     required this.id,
     required this.name,
-    required this.elapsed,
     required this.overdue,
     required this.start,
+    this.overdueAt,
+    this.clockOffset = Duration.zero,
   });
 
-  factory Session.fromJson(Map<String, dynamic> json) {
+  factory Session.fromJson(
+    Map<String, dynamic> json, {
+    Duration clockOffset = Duration.zero,
+  }) {
     return Session(
       id: json['id'] is int ? json['id'] : 0,
       name: json['name'] ?? 'Unknown',
-      elapsed: json['elapsed'] is int ? json['elapsed'] : 0,
       overdue: json['overdue'] ?? false,
       start: DateTime.tryParse(json['start'] ?? '') ?? DateTime.now(),
+      overdueAt: DateTime.tryParse(json['overdue_at'] ?? ''),
+      clockOffset: clockOffset,
     );
   }
+
+  // Elapsed time is computed locally (the server sends absolute times only)
+  DateTime get serverNow => DateTime.now().add(clockOffset);
+
+  int get elapsed {
+    final int seconds = serverNow.difference(start).inSeconds;
+    return seconds < 0 ? 0 : seconds;
+  }
+
   // Helpers
   String get timerText {
     final int minutes = (elapsed / 60).floor();
@@ -30,6 +47,7 @@ class Session {
   }
 
   // Alias for compatibility if needed, or update consumers
-  bool get isOverdue => overdue;
+  bool get isOverdue =>
+      overdue || (overdueAt != null && !serverNow.isBefore(overdueAt!));
   String get studentName => name;
 }
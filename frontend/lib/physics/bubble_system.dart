@@ -35,6 +35,7 @@ class BubbleModel {
   bool isOverdue = false;
 
   DateTime? sessionStart;
+  DateTime? overdueAt;
 
   BubbleModel({
     required this.id,
@@ -61,6 +62,10 @@ class BubbleModel {
       final int mins = (elapsed / 60).floor();
       final int secs = elapsed % 60;
       timerText = "$mins:${secs.toString().padLeft(2, '0')}";
+      // Turn overdue on time without waiting for the next status update
+      if (overdueAt != null && !DateTime.now().isBefore(overdueAt!)) {
+        isOverdue = true;
+      }
     }
   }
 
@@ -89,7 +94,8 @@ class BubbleModel {
       name = sessionData.name;
       // Sync stats immediately
       // Snap to nearest second to sync timer ticks across devices/passes
-      final rawStart = sessionData.start;
+      // (start and deadline are shifted onto the local clock)
+      final rawStart = sessionData.start.subtract(sessionData.clockOffset);
       sessionStart = rawStart.subtract(
         Duration(
           milliseconds: rawStart.millisecond,
@@ -97,7 +103,8 @@ class BubbleModel {
         ),
       );
 
-      isOverdue = sessionData.overdue;
+      overdueAt = sessionData.overdueAt?.subtract(sessionData.clockOffset);
+      isOverdue = sessionData.isOverdue;
 
       // Update text immediately
       final int elapsed = DateTime.now().difference(sessionStart!).inSeconds;
@@ -109,16 +116,19 @@ class BubbleModel {
       timerText = "";
       isOverdue = true;
       sessionStart = null;
+      overdueAt = null;
     } else if (newType == BubbleType.suspended) {
       name = "SUSPENDED";
       timerText = "";
       isOverdue = true;
       sessionStart = null;
+      overdueAt = null;
     } else {
       name = "Scan ID";
       timerText = "";
       isOverdue = false;
       sessionStart = null;
+      overdueAt = null;
     }
   }
 }
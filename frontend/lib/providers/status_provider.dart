@@ -1,5 +1,8 @@
 import 'dart:async';
+import 'dart:convert';
+import 'dart:js_interop';
 import 'package:flutter/foundation.dart';
+import 'package:web/web.dart' as web;
 import '../models/kiosk_status.dart';
 import '../services/api_service.dart';
 import '../services/sound_service.dart';
@@ -13,6 +16,13 @@ class StatusProvider with ChangeNotifier {
   String? _token;
   Timer? _pollTimer;
 
+  // Polling follows the server's suggested interval (poll_interval)
+  Duration _pollInterval = const Duration(seconds: 2);
+  // While /events is delivering, polling is only a slow safety net
+  static const Duration _streamingPollInterval = Duration(seconds: 60);
+  web.EventSource? _events;
+  bool _streaming = false;
+
   // Getters
   KioskStatus? get status => _status;
   bool get isLoading => _isLoading;
@@ -22,26 +32,81 @@ class StatusProvider with ChangeNotifier {
   // Initialize with token (e.g., from URL path)
   void init(String token) {
     _token = token;
-    fetchStatus();
-    // Poll every 2 seconds for updates (simple alternative to SSE for now)
-    _pollTimer = Timer.periodic(
-      const Duration(seconds: 2),
-      (_) => fetchStatus(),
-    );
+    _connectEvents();
+    _poll();
   }
 
   @override
   void dispose() {
     _pollTimer?.cancel();
+    _events?.close();
     super.dispose();
   }
 
+  Future<void> _poll() async {
+    await fetchStatus();
+    _schedulePoll();
+  }
+
+  void _schedulePoll() {
+    _pollTimer?.cancel();
+    _pollTimer = Timer(
+      _streaming ? _streamingPollInterval : _pollInterval,
+      _poll,
+    );
+  }
+
+  // Server-sent events push every change as it happens; the browser
+  // reconnects (with Last-Event-ID) on its own, and we poll while it's down.
+  void _connectEvents() {
+    if (!kIsWeb || _token == null) return;
+    try {
+      final uri = Uri(path: '/events', queryParameters: {'token': _token});
+      final source = web.EventSource(uri.toString());
+      source.onopen = ((web.Event _) {
+        _streaming = true;
+        _schedulePoll();
+      }).toJS;
+      source.onmessage = ((web.MessageEvent event) {
+        _applyEvent((event.data as JSString).toDart);
+      }).toJS;
+      source.onerror = ((web.Event _) {
+        if (_streaming) {
+          _streaming = false;
+          _poll();
+        }
+      }).toJS;
+      _events = source;
+    } catch (e) {
+      if (kDebugMode) {
+        print("Event stream unavailable, polling instead: $e");
+      }
+    }
+  }
+
+  void _applyEvent(String data) {
+    try {
+      _status = KioskStatus.fromJson(json.decode(data));
+      _error = null;
+      _isLoading = false;
+      notifyListeners();
+    } catch (e) {
+      if (kDebugMode) {
+        print("Bad status event: $e");
+      }
+    }
+  }
+
   Future<void> fetchStatus() async {
     if (_token == null) return;
 
     try {
       final newStatus = await _api.getStatus(_token!);
-      _status = newStatus;
+      // null means 304 Not Modified: keep the status we already have
+      if (newStatus != null) {
+        _status = newStatus;
+        _pollInterval = newStatus.pollInterval ?? _pollInterval;
+      }
       _error = null; // Clear error on success
     } catch (e) {
       if (kDebugMode) {
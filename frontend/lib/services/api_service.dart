@@ -23,14 +23,29 @@ class ApiService {
     return Uri.parse(url).replace(queryParameters: queryParams);
   }
 
-  Future<KioskStatus> getStatus(String token) async {
+  // Validator of the last /api/status body, sent back as If-None-Match
+  String? _statusETag;
+  String? _statusETagToken;
+
+  /// Returns null when the status hasn't changed since the last call (304).
+  Future<KioskStatus?> getStatus(String token) async {
     final uri = _getUri('/api/status', {'token': token});
+    final headers = <String, String>{};
+    if (_statusETag != null && _statusETagToken == token) {
+      headers['If-None-Match'] = _statusETag!;
+    }
 
     try {
-      final response = await http.get(uri);
+      final response = await http.get(uri, headers: headers);
 
+      if (response.statusCode == 304) {
+        return null;
+      }
       if (response.statusCode == 200) {
-        return KioskStatus.fromJson(json.decode(response.body));
+        final status = KioskStatus.fromJson(json.decode(response.body));
+        _statusETag = response.headers['etag'];
+        _statusETagToken = token;
+        return status;
       } else {
         throw Exception('Failed to load status: ${response.statusCode}');
       }
@@ -136,9 +151,31 @@ class ApiService {
       final body = json.decode(response.body);
       return body['count'] ?? 0;
     }
+    if (response.statusCode == 202) {
+      // Large files are imported in the background; poll until it finishes
+      final body = json.decode(response.body);
+      return _waitForRosterImport(body['job_id']);
+    }
     throw Exception('Failed to upload roster: ${response.body}');
   }
 
+  Future<int> _waitForRosterImport(String jobId) async {
+    final uri = _getUri('/api/roster/import/$jobId');
+    while (true) {
+      await Future.delayed(const Duration(seconds: 1));
+      final response = await http.get(uri);
+      if (response.statusCode == 401) throw Exception('Unauthorized');
+      if (response.statusCode != 200) {
+        throw Exception('Failed to check roster import: ${response.body}');
+      }
+      final body = json.decode(response.body);
+      if (body['status'] == 'complete') return body['result']?['count'] ?? 0;
+      if (body['status'] == 'failed') {
+        throw Exception('Roster import failed: ${body['error']}');
+      }
+    }
+  }
+
   Future<List<Map<String, dynamic>>> getPassLogs() async {
     final uri = _getUri('/api/admin/logs');
     final response = await http.get(uri);
@@ -0,0 +1,57 @@
+"""
+Gunicorn settings, picked up automatically by `gunicorn app:app` from the project root.
+
+/events streams are long-lived. With the default gevent workers each open
+stream is a cheap greenlet, so kiosks and displays don't use up worker
+capacity for normal API requests. Set HALLPASS_WORKER_CLASS=gthread (or sync)
+to fall back to thread/process-per-connection serving.
+
+Worker count and port come from gunicorn's own WEB_CONCURRENCY and PORT.
+Don't combine gevent with --preload: the app would be imported before gevent
+patches the standard library.
+"""
+import os
+
+
+def _default_worker_class() -> str:
+    try:
+        import gevent  # noqa: F401
+        return "gevent"
+    except ImportError:
+        return "gthread"
+
+
+worker_class = os.getenv("HALLPASS_WORKER_CLASS") or _default_worker_class()
+# gevent: concurrent connections (streams + requests) per worker
+worker_connections = int(os.getenv("HALLPASS_WORKER_CONNECTIONS", "2000"))
+# gthread: threads per worker (each open stream holds one)
+threads = int(os.getenv("HALLPASS_WORKER_THREADS", "32"))
+
+
+def _make_psycopg2_green() -> None:
+    """Let psycopg2 yield to other greenlets while waiting on PostgreSQL"""
+    try:
+        import psycopg2
+        from psycopg2 import extensions
+    except ImportError:
+        return
+    from gevent.socket import wait_read, wait_write
+
+    def wait_callback(conn, timeout=None):
+        while True:
+            state = conn.poll()
+            if state == extensions.POLL_OK:
+                break
+            elif state == extensions.POLL_READ:
+                wait_read(conn.fileno(), timeout=timeout)
+            elif state == extensions.POLL_WRITE:
+                wait_write(conn.fileno(), timeout=timeout)
+            else:
+                raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+    extensions.set_wait_callback(wait_callback)
+
+
+def post_fork(server, worker):
+    if worker_class == "gevent":
+        _make_psycopg2_green()
@@ -1,5 +1,7 @@
 # Models package initialization
 # User model uses factory pattern - import create_user_model, not User directly
 from .user import create_user_model
+from .expressions import whole_seconds_between
+from .types import UTCDateTime
 
-__all__ = ['create_user_model']
+__all__ = ['create_user_model', 'whole_seconds_between', 'UTCDateTime']
@@ -0,0 +1,36 @@
+"""
+SQL Expressions: Portable time arithmetic for model hybrids
+SQLite has no interval type, so elapsed time is written per dialect:
+EXTRACT(EPOCH ...) on PostgreSQL and epoch-microsecond integers elsewhere.
+"""
+from sqlalchemy import Integer
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+
+class whole_seconds_between(FunctionElement):
+    """Whole seconds from start to end, truncated like int() (NULL if either is NULL)"""
+    type = Integer()
+    inherit_cache = True
+    name = "whole_seconds_between"
+
+
+def _sqlite_microseconds(ts: str) -> str:
+    # SQLAlchemy stores SQLite timestamps as 'YYYY-MM-DD HH:MM:SS.ffffff'. Count
+    # whole seconds with strftime('%s') and add the microsecond digits, so the
+    # arithmetic is exact integers (julianday() floats can't resolve them).
+    return f"(CAST(strftime('%s', {ts}) AS INTEGER) * 1000000 + CAST(substr({ts}, 21, 6) AS INTEGER))"
+
+
+@compiles(whole_seconds_between)
+def _whole_seconds_between_default(element, compiler, **kw):
+    start, end = (compiler.process(arg, **kw) for arg in element.clauses)
+    # Integer division truncates like int() for the non-negative spans this is used on
+    return f"(({_sqlite_microseconds(end)} - {_sqlite_microseconds(start)}) / 1000000)"
+
+
+@compiles(whole_seconds_between, "postgresql")
+def _whole_seconds_between_postgresql(element, compiler, **kw):
+    start, end = (compiler.process(arg, **kw) for arg in element.clauses)
+    # A numeric -> integer cast rounds on PostgreSQL, so floor first
+    return f"CAST(floor(EXTRACT(EPOCH FROM ({end} - {start}))) AS INTEGER)"
@@ -0,0 +1,27 @@
+"""
+Column Types: Timestamps that always come back timezone-aware
+SQLite has no timezone storage, so DateTime(timezone=True) columns read back
+naive there; PostgreSQL returns them aware. UTCDateTime stores UTC and tags
+naive results as UTC, so the app sees the same values on both.
+"""
+from datetime import timezone
+
+from sqlalchemy import DateTime
+from sqlalchemy.types import TypeDecorator
+
+
+class UTCDateTime(TypeDecorator):
+    """DateTime(timezone=True) that writes UTC and always reads back aware"""
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        # SQLite keeps only the wall clock, so normalise before it drops the offset
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
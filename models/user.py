@@ -5,11 +5,14 @@ import secrets
 from datetime import datetime, timezone
 
 
-def create_user_model(db):
+def create_user_model(db, on_kiosk_token_change=None):
     """Factory function to create User model with the given db instance.
     
     This pattern allows the model to be created after the db is initialized
     in app.py, avoiding circular imports.
+    
+    on_kiosk_token_change is called with the user whenever its kiosk token
+    or slug changes, so cached token lookups can be dropped.
     """
     
     class User(db.Model):
@@ -46,12 +49,14 @@ def create_user_model(db):
         def regenerate_kiosk_token(self):
             """Generate a new kiosk token"""
             self.kiosk_token = secrets.token_urlsafe(16)
+            self._kiosk_token_changed()
             return self.kiosk_token
         
         def set_kiosk_slug(self, slug: str) -> bool:
             """Set a custom kiosk slug, returns False if invalid"""
             if not slug:
                 self.kiosk_slug = None
+                self._kiosk_token_changed()
                 return True
             
             # Validate slug format (lowercase, alphanumeric, hyphens only, 1-64 chars)
@@ -60,8 +65,14 @@ def create_user_model(db):
                 return False
             
             self.kiosk_slug = slug
+            self._kiosk_token_changed()
             return True
         
+        def _kiosk_token_changed(self):
+            """Notify the token cache that this user's public tokens changed"""
+            if on_kiosk_token_change is not None:
+                on_kiosk_token_change(self)
+        
         def get_public_urls(self, base_url: str) -> dict:
             """Get the public URLs for kiosk and display"""
             token = self.kiosk_slug or self.kiosk_token
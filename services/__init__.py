@@ -2,5 +2,8 @@
 from .roster import RosterService
 from .ban import BanService
 from .session import SessionService
+from .settings import SettingsService
+from .roster_import import RosterImporter
+from .status import StatusService
 
-__all__ = ['RosterService', 'BanService', 'SessionService']
+__all__ = ['RosterService', 'BanService', 'SessionService', 'SettingsService', 'RosterImporter', 'StatusService']
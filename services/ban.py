@@ -2,20 +2,35 @@
 Ban Service: Handles student ban management
 Refactored for 2.0 multi-tenancy with stateless user_id scoping
 """
+from datetime import datetime, timezone
 from typing import Dict, List, Any, Optional
 
+from .memo import memoize_per_request
+
 
 class BanService:
-    def __init__(self, db, student_name_model, roster_service):
+    def __init__(self, db, student_name_model, session_model, roster_service):
         """
         Initialize BanService.
+
+        Args:
+            db: SQLAlchemy database instance
+            student_name_model: StudentName model class (holds ban flags)
+            session_model: Session model class (overdue checks run in SQL)
+            roster_service: RosterService (hashing, names, in-memory index)
         """
         self.db = db
         self.StudentName = student_name_model
+        self.Session = session_model
         self.roster_service = roster_service
     
+    @memoize_per_request("student_banned")
     def is_student_banned(self, user_id: Optional[int], student_id: str) -> bool:
         """Check if a student is banned from using the restroom"""
+        # Rostered students are answered from the in-memory index
+        entry = self.roster_service.get_entry(user_id, student_id)
+        if entry is not None:
+            return entry.banned
         try:
             name_hash = self.roster_service._hash_student_id(student_id, user_id)
             
@@ -29,8 +44,11 @@ class BanService:
         except Exception:
             return False
     
-    def set_student_banned(self, user_id: Optional[int], student_id: str, banned_status: bool) -> bool:
-        """Ban or unban a student from using the restroom"""
+    def set_student_banned(self, user_id: Optional[int], student_id: str, banned_status: bool, commit: bool = True) -> bool:
+        """Ban or unban a student from using the restroom.
+        
+        Pass commit=False to leave the change in the caller's transaction.
+        """
         try:
             name_hash = self.roster_service._hash_student_id(student_id, user_id)
             
@@ -42,7 +60,11 @@ class BanService:
             student_name = query.first()
             if student_name:
                 student_name.banned = banned_status
-                self.db.session.commit()
+                # Ban flags live in every worker's student index
+                self.roster_service.bump_generation(user_id)
+                if commit:
+                    self.db.session.commit()
+                self.roster_service.update_entry(user_id, student_id, banned=bool(banned_status))
                 return True
             return False
         except Exception:
@@ -52,43 +74,37 @@ class BanService:
                 pass
             return False
     
-    def get_overdue_students(self, user_id: Optional[int], open_sessions: list, overdue_minutes: int) -> List[Dict[str, Any]]:
-        """Get list of students who are currently overdue"""
+    def get_overdue_students(self, user_id: Optional[int], overdue_minutes: int,
+                             now: Optional[datetime] = None) -> List[Dict[str, Any]]:
+        """Get list of students who are overdue as of `now` (default: current time), longest out first"""
         try:
-            overdue_seconds = overdue_minutes * 60
-            overdue_list = []
-            
-            for session_obj in open_sessions:
-                # Filter by user_id if set
-                if user_id is not None and hasattr(session_obj, 'user_id'):
-                    if session_obj.user_id != user_id:
-                        continue
-                
-                if session_obj.duration_seconds > overdue_seconds:
-                    # Pass user_id to roster service
-                    student_name = self.roster_service.get_student_name(
-                        user_id, session_obj.student_id, "Student"
-                    )
-                    is_banned = self.is_student_banned(user_id, session_obj.student_id)
-                    
-                    overdue_list.append({
-                        'student_id': session_obj.student_id,
-                        'name': student_name,
-                        'duration_seconds': session_obj.duration_seconds,
-                        'duration_minutes': round(session_obj.duration_seconds / 60, 1),
-                        'start_ts': session_obj.start_ts.isoformat(),
-                        'banned': is_banned,
-                        'session_id': session_obj.id
-                    })
-            
-            return overdue_list
+            now = now or datetime.now(timezone.utc)
+            duration = self.Session.duration_at(now)
+            # Filtered and sorted by the database; only overdue sessions are loaded
+            query = self.db.session.query(self.Session, duration) \
+                .filter(self.Session.end_ts.is_(None), self.Session.is_overdue(overdue_minutes * 60, now))
+            if user_id is not None:
+                query = query.filter(self.Session.user_id == user_id)
+            rows = query.order_by(duration.desc()).all()
+            names = self.roster_service.get_student_names(
+                user_id, list(dict.fromkeys(s.student_id for s, _ in rows)), "Student")
+
+            return [{
+                'student_id': session_obj.student_id,
+                'name': names.get(session_obj.student_id) or "Student",
+                'duration_seconds': duration,
+                'duration_minutes': round(duration / 60, 1),
+                'start_ts': session_obj.start_ts.isoformat(),
+                'banned': self.is_student_banned(user_id, session_obj.student_id),
+                'session_id': session_obj.id
+            } for session_obj, duration in rows]
         except Exception:
             return []
     
-    def auto_ban_overdue_students(self, user_id: Optional[int], open_sessions: list, overdue_minutes: int) -> Dict[str, Any]:
+    def auto_ban_overdue_students(self, user_id: Optional[int], overdue_minutes: int) -> Dict[str, Any]:
         """Automatically ban students who are currently overdue"""
         try:
-            overdue_list = self.get_overdue_students(user_id, open_sessions, overdue_minutes)
+            overdue_list = self.get_overdue_students(user_id, overdue_minutes)
             banned_count = 0
             banned_students = []
             
@@ -0,0 +1,241 @@
+"""
+Status Broadcaster: One status poller per tenant, shared by all /events streams
+Each tenant with at least one subscriber gets a single background thread that
+builds the status payload once per tick and, when it changed, fans the
+serialized frame out to every subscriber queue. Streams themselves never
+touch the database.
+
+Frames carry SSE event ids and the most recent ones are kept per tenant, so a
+client reconnecting with Last-Event-ID is sent only the frames it missed.
+
+Channels are keyed by whatever build_status takes: tenants for /events, job
+ids for roster import progress, whose streams end once a final frame is sent.
+"""
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Set, Tuple
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+HEARTBEAT = ": heartbeat\n\n"
+# Queued after a final frame: the stream ends once it reaches it
+_END = None
+
+
+class _Channel:
+    """Subscribers, broadcast state and recent frames for one tenant"""
+
+    def __init__(self, floor: int, history_size: int):
+        self.subscribers: Set[queue.Queue] = set()
+        self.last_payload: Optional[Dict[str, Any]] = None
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        # Recent (seq, payload) frames; every seq above `floor` is in here
+        self.history: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=history_size)
+        self.floor = floor
+        self.idle_since: Optional[float] = None
+
+    def missed(self, seq: Optional[int]) -> Optional[List[Tuple[int, Dict[str, Any]]]]:
+        """Frames after seq, or None when they can't all be replayed"""
+        latest = self.history[-1][0] if self.history else self.floor
+        if seq is None or not self.floor <= seq <= latest:
+            return None
+        return [entry for entry in self.history if entry[0] > seq]
+
+
+class StatusBroadcaster:
+    def __init__(self, app, db, build_status: Callable[[Optional[int]], Dict[str, Any]],
+                 interval: float = 1.0, queue_size: int = 4,
+                 stamp: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+                 history_size: int = 64, linger: float = 30.0, heartbeat: float = 15.0,
+                 final: Optional[Callable[[Dict[str, Any]], bool]] = None):
+        """
+        Initialize StatusBroadcaster.
+
+        Args:
+            app: Flask app (ticks run in their own app context)
+            db: SQLAlchemy database instance
+            build_status: Builds a tenant's status payload from the database
+            interval: Seconds between ticks
+            queue_size: Frames buffered per subscriber; a slow client only
+                ever misses intermediate frames, never the latest one
+            stamp: Adds send-time fields (e.g. a server clock) to a payload
+                as it is serialized; they don't count as a change
+            history_size: Recent frames kept per tenant for Last-Event-ID replay
+            linger: Seconds a tenant keeps ticking (and recording frames) after
+                its last subscriber leaves, so a quick reconnect can replay
+            heartbeat: Seconds of silence before a stream sends a comment
+                line, so idle proxies don't cut it
+            final: Recognizes a last payload (e.g. a finished job): streams
+                end after sending it and the channel stops ticking
+        """
+        self.app = app
+        self.db = db
+        self.build_status = build_status
+        self.interval = interval
+        self.queue_size = queue_size
+        self.stamp = stamp
+        self.history_size = history_size
+        self.linger = linger
+        self.heartbeat = heartbeat
+        self.final = final
+        self._channels: Dict[Optional[int], _Channel] = {}
+        self._lock = threading.Lock()
+        # Event ids are "<process>-<seq>": seq comes from one counter shared by
+        # all tenants, so an id is never reused within a process
+        self._seq = itertools.count(1)
+        self._pid: Optional[int] = None
+        self._process = ""
+
+    @property
+    def process(self) -> str:
+        """Id prefix for this process (regenerated after a fork)"""
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._process = uuid.uuid4().hex[:8]
+        return self._process
+
+    def parse_event_id(self, event_id: Optional[str]) -> Optional[int]:
+        """Sequence number from a Last-Event-ID issued by this process, else None"""
+        process, _, seq = (event_id or "").strip().partition("-")
+        if process != self.process or not seq.isdigit():
+            return None
+        return int(seq)
+
+    def subscribe(self, user_id: Optional[int], last_event_id: Optional[str] = None) -> queue.Queue:
+        """Register a subscriber, starting the tenant's broadcaster if needed.
+
+        The queue starts with the frames missed since last_event_id, or with
+        the latest frame when those can't be replayed.
+        """
+        last_seq = self.parse_event_id(last_event_id)
+        with self._lock:
+            channel = self._channels.get(user_id)
+            if channel is None:
+                channel = self._channels[user_id] = _Channel(next(self._seq), self.history_size)
+            channel.idle_since = None
+            backlog = channel.missed(last_seq)
+            if backlog is None:
+                backlog = [channel.history[-1]] if channel.history else []
+            q: queue.Queue = queue.Queue(maxsize=self.queue_size + len(backlog) + 1)
+            for seq, payload in backlog:
+                q.put_nowait(self._frame(seq, payload))
+            if channel.last_payload is not None and self._is_final(channel.last_payload):
+                q.put_nowait(_END)
+            channel.subscribers.add(q)
+            if channel.thread is None:
+                channel.thread = threading.Thread(target=self._run, args=(user_id, channel), daemon=True,
+                                                  name=f"status-broadcast-{user_id}")
+                channel.thread.start()
+        return q
+
+    def unsubscribe(self, user_id: Optional[int], q: queue.Queue) -> None:
+        with self._lock:
+            channel = self._channels.get(user_id)
+            if channel is not None:
+                channel.subscribers.discard(q)
+                if not channel.subscribers:
+                    channel.idle_since = time.monotonic()
+
+    def listen(self, user_id: Optional[int], last_event_id: Optional[str] = None) -> Iterator[str]:
+        """Yield SSE-formatted frames (and heartbeats) for a tenant until the consumer
+        stops or a final frame has been sent"""
+        q = self.subscribe(user_id, last_event_id)
+        try:
+            while True:
+                try:
+                    frame = q.get(timeout=self.heartbeat)
+                except queue.Empty:
+                    yield HEARTBEAT
+                    continue
+                if frame is _END:
+                    return
+                yield frame
+        finally:
+            self.unsubscribe(user_id, q)
+
+    def wake(self, user_id: Optional[int]) -> None:
+        """Make the tenant's broadcaster tick now instead of at its next interval"""
+        channel = self._channels.get(user_id)
+        if channel is not None:
+            channel.wake.set()
+
+    def _is_final(self, payload: Dict[str, Any]) -> bool:
+        return self.final is not None and self.final(payload)
+
+    def _frame(self, seq: int, payload: Dict[str, Any]) -> str:
+        data = json.dumps(self.stamp(payload) if self.stamp else payload)
+        return f"id: {self.process}-{seq}\ndata: {data}\n\n"
+
+    def _publish(self, channel: _Channel, payload: Dict[str, Any]) -> None:
+        with self._lock:
+            seq = next(self._seq)
+            if len(channel.history) == channel.history.maxlen:
+                channel.floor = channel.history[0][0]
+            channel.history.append((seq, payload))
+            channel.last_payload = payload
+            subscribers = list(channel.subscribers)
+        frame = self._frame(seq, payload)
+        final = self._is_final(payload)
+        for q in subscribers:
+            self._offer(q, frame)
+            if final:
+                self._offer(q, _END)
+
+    @staticmethod
+    def _offer(q: queue.Queue, item: Optional[str]) -> None:
+        try:
+            q.put_nowait(item)
+        except queue.Full:
+            # Drop the oldest frame; the newest one supersedes it anyway
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+            try:
+                q.put_nowait(item)
+            except queue.Full:
+                pass
+
+    def _run(self, user_id: Optional[int], channel: _Channel) -> None:
+        while True:
+            with self._lock:
+                if not channel.subscribers and (
+                        channel.idle_since is None or time.monotonic() - channel.idle_since >= self.linger):
+                    # Nobody came back in time: retire the channel and its history
+                    channel.thread = None
+                    if self._channels.get(user_id) is channel:
+                        del self._channels[user_id]
+                    return
+            channel.wake.clear()
+            try:
+                with self.app.app_context():
+                    try:
+                        payload = self.build_status(user_id)
+                    finally:
+                        # Hand the connection back to the pool between ticks
+                        self.db.session.remove()
+                if payload != channel.last_payload:
+                    self._publish(channel, payload)
+                if self._is_final(payload):
+                    # Nothing more will change: subscribers were sent the end
+                    with self._lock:
+                        channel.thread = None
+                        if self._channels.get(user_id) is channel:
+                            del self._channels[user_id]
+                    return
+            except Exception as e:
+                print(f"Status broadcast for user {user_id} failed: {e}")
+            channel.wake.wait(self.interval)
+
+    def stats(self) -> Dict[str, int]:
+        """Active tenants and subscribers in this worker"""
+        with self._lock:
+            return {
+                "tenants": len(self._channels),
+                "subscribers": sum(len(c.subscribers) for c in self._channels.values()),
+            }
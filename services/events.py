@@ -0,0 +1,247 @@
+"""
+Event Bus: Tenant change notifications, published after commit
+Writers record (kind, user_id) events on the SQLAlchemy session; they are
+delivered to in-process subscribers once the transaction commits (and dropped
+on rollback). A pluggable transport carries them to the other workers:
+PostgreSQL LISTEN/NOTIFY in production, or unix datagram sockets in a shared
+directory for local multi-worker runs and tests.
+"""
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
+import atexit
+import json
+import os
+import select
+import socket
+import threading
+import uuid
+
+from sqlalchemy import event, text
+
+# Event kinds
+STATUS = "status"  # Sessions, queue, settings or names changed: push fresh status
+ROSTER = "roster"  # Roster changed: re-check the roster generation now
+IMPORT = "import"  # A roster import job checkpointed: keyed by job id rather than user id
+TOKEN = "token"  # Kiosk token or slug changed: drop cached token/slug lookups
+
+Event = Tuple[str, Union[int, str, None]]
+
+_SESSION_KEY = "tenant_events"
+
+
+class LocalTransport:
+    """Single-process delivery only (no cross-worker fan-out)"""
+
+    def start(self, deliver: Callable[[bytes], None]) -> None:
+        pass
+
+    def send(self, message: bytes) -> None:
+        pass
+
+
+class PostgresTransport:
+    """Cross-worker delivery through PostgreSQL LISTEN/NOTIFY"""
+
+    def __init__(self, engine, channel: str = "hallpass_events"):
+        self.engine = engine
+        self.channel = channel
+
+    def start(self, deliver: Callable[[bytes], None]) -> None:
+        threading.Thread(target=self._listen, args=(deliver,), daemon=True, name="event-bus-listen").start()
+
+    def send(self, message: bytes) -> None:
+        with self.engine.connect() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :payload)"),
+                         {"channel": self.channel, "payload": message.decode()})
+            conn.commit()
+
+    def _listen(self, deliver: Callable[[bytes], None]) -> None:
+        # A dedicated driver connection outside the pool, reconnecting on failure
+        while True:
+            raw = None
+            try:
+                raw = self.engine.raw_connection()
+                dbapi_conn = raw.driver_connection
+                dbapi_conn.autocommit = True
+                with dbapi_conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self.channel}")
+                while True:
+                    if select.select([dbapi_conn], [], [], 30)[0]:
+                        dbapi_conn.poll()
+                        while dbapi_conn.notifies:
+                            deliver(dbapi_conn.notifies.pop(0).payload.encode())
+            except Exception as e:
+                print(f"Event bus listener error (reconnecting): {e}")
+            finally:
+                if raw is not None:
+                    try:
+                        raw.invalidate()
+                    except Exception:
+                        pass
+            threading.Event().wait(5)
+
+
+class SocketTransport:
+    """Cross-worker delivery through unix datagram sockets in a shared directory.
+
+    Each process binds one socket in the directory and sends to every other
+    socket found there; sockets of dead processes are cleaned up on send.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.path: Optional[str] = None
+        self._sock: Optional[socket.socket] = None
+
+    def start(self, deliver: Callable[[bytes], None]) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.sock")
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        atexit.register(self._cleanup)
+        threading.Thread(target=self._listen, args=(deliver,), daemon=True, name="event-bus-listen").start()
+
+    def send(self, message: bytes) -> None:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as out:
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if path == self.path or not name.endswith(".sock"):
+                    continue
+                try:
+                    out.sendto(message, path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    # Owner is gone
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                except OSError:
+                    pass
+
+    def _listen(self, deliver: Callable[[bytes], None]) -> None:
+        while True:
+            try:
+                deliver(self._sock.recv(65536))
+            except Exception as e:
+                print(f"Event bus listener error: {e}")
+
+    def _cleanup(self) -> None:
+        if self.path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def make_transport(kind: str, engine, socket_dir: str):
+    """Build the transport named by config ("auto" picks Postgres when available)"""
+    if kind == "auto":
+        kind = "postgres" if engine.dialect.name == "postgresql" else "local"
+    if kind == "postgres":
+        return PostgresTransport(engine)
+    if kind == "socket":
+        return SocketTransport(socket_dir)
+    return LocalTransport()
+
+
+class EventBus:
+    def __init__(self, transport_factory: Callable[[], object]):
+        """
+        Initialize EventBus.
+
+        Args:
+            transport_factory: Builds the cross-worker transport. Called lazily
+                in each worker process, since listener threads don't survive
+                gunicorn's fork.
+        """
+        self.transport_factory = transport_factory
+        self.origin = uuid.uuid4().hex
+        self._subscribers: Dict[str, List[Tuple[Callable[[Optional[int]], None], bool]]] = defaultdict(list)
+        self._transport = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+        self.published = 0
+        self.received = 0
+
+    def subscribe(self, kind: str, callback: Callable[[Optional[int]], None], remote_only: bool = False) -> None:
+        """Call callback(user_id) whenever an event of this kind is delivered.
+
+        remote_only skips events published by this worker (for caches the
+        writer already updated itself).
+        """
+        self._subscribers[kind].append((callback, remote_only))
+
+    def attach(self, session) -> None:
+        """Publish a session's recorded events after commit; drop them on rollback"""
+        event.listen(session, "after_commit", self._after_commit)
+        event.listen(session, "after_rollback", self._after_rollback)
+
+    def notify(self, session, user_id: Optional[int], *kinds: str) -> None:
+        """Record events to publish once the session's transaction commits"""
+        pending: Set[Event] = session.info.setdefault(_SESSION_KEY, set())
+        for kind in kinds or (STATUS,):
+            pending.add((kind, user_id))
+
+    def _after_commit(self, session) -> None:
+        pending = session.info.pop(_SESSION_KEY, None)
+        if pending:
+            self.publish(pending)
+
+    def _after_rollback(self, session) -> None:
+        session.info.pop(_SESSION_KEY, None)
+
+    def publish(self, events: Iterable[Event]) -> None:
+        """Deliver events here and send them to the other workers"""
+        events = list(events)
+        self._dispatch(events, remote=False)
+        transport = self.start()
+        try:
+            transport.send(json.dumps({"o": self.origin, "e": events}).encode())
+            self.published += 1
+        except Exception as e:
+            print(f"Event bus publish failed: {e}")
+
+    def start(self):
+        """Start this process's transport (idempotent; restarts after a fork)"""
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    # Forked workers must not share the parent's origin id
+                    self.origin = uuid.uuid4().hex
+                    try:
+                        transport = self.transport_factory()
+                        transport.start(self._receive)
+                    except Exception as e:
+                        print(f"Event bus transport unavailable, delivering locally only: {e}")
+                        transport = LocalTransport()
+                    self._transport = transport
+                    self._pid = pid
+        return self._transport
+
+    def _receive(self, message: bytes) -> None:
+        try:
+            data = json.loads(message)
+        except ValueError:
+            return
+        if data.get("o") == self.origin:
+            return
+        self.received += 1
+        self._dispatch([(kind, user_id) for kind, user_id in data.get("e", [])], remote=True)
+
+    def _dispatch(self, events: Iterable[Event], remote: bool) -> None:
+        for kind, user_id in events:
+            for callback, remote_only in self._subscribers.get(kind, ()):
+                if remote_only and not remote:
+                    continue
+                try:
+                    callback(user_id)
+                except Exception as e:
+                    print(f"Event bus subscriber failed: {e}")
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "transport": type(self._transport).__name__ if self._transport else None,
+            "published": self.published,
+            "received": self.received,
+        }
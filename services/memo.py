@@ -0,0 +1,83 @@
+"""
+Request Memo: Per-request memoization of tenant context lookups
+Each fact (open sessions, queue, a student's name...) is computed once per
+request no matter how many code paths ask for it. The memo lives on flask.g
+and is dropped whenever the session flushes, commits or rolls back, so
+callers never see values older than their own writes.
+"""
+from functools import wraps
+from typing import Any, Dict
+import threading
+
+from flask import g, has_request_context
+
+# Process-wide totals, reported by /api/dev/stats
+_totals = {"hits": 0, "misses": 0}
+_totals_lock = threading.Lock()
+
+
+class RequestMemo:
+    """Memo storage for a single request"""
+
+    def __init__(self):
+        self.values: Dict[Any, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def clear(self) -> None:
+        self.values.clear()
+
+
+def get_request_memo():
+    """Return the current request's memo, or None outside a request"""
+    if not has_request_context():
+        return None
+    memo = g.get('_request_memo')
+    if memo is None:
+        memo = g._request_memo = RequestMemo()
+    return memo
+
+
+def clear_request_memo(*_args, **_kwargs) -> None:
+    """Drop memoized values (signature accepts SQLAlchemy event arguments)"""
+    if has_request_context():
+        memo = g.get('_request_memo')
+        if memo is not None:
+            memo.clear()
+
+
+def memoize_per_request(namespace: str):
+    """Decorator: memoize a lookup for the rest of the current request.
+
+    Arguments (including self for methods) form the key, so they must be
+    hashable. Outside a request the function is simply called.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            memo = get_request_memo()
+            if memo is None:
+                return f(*args, **kwargs)
+            key = (namespace, args, tuple(sorted(kwargs.items())))
+            if key in memo.values:
+                memo.hits += 1
+                return memo.values[key]
+            memo.misses += 1
+            value = f(*args, **kwargs)
+            memo.values[key] = value
+            return value
+        return wrapper
+    return decorator
+
+
+def record_request_memo(memo: RequestMemo) -> None:
+    """Add a finished request's counts to the process totals"""
+    with _totals_lock:
+        _totals["hits"] += memo.hits
+        _totals["misses"] += memo.misses
+
+
+def get_memo_totals() -> Dict[str, int]:
+    """Process-wide hit/miss totals (hits are deduplicated lookups)"""
+    with _totals_lock:
+        return dict(_totals)
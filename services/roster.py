@@ -2,12 +2,36 @@
 Roster Service: Handles student roster management
 Refactored for 2.0 multi-tenancy with stateless user_id scoping
 """
-from typing import Dict, Optional, Any
+from functools import lru_cache
+from typing import Dict, List, Optional, Any, NamedTuple, Tuple
 import hashlib
+import threading
+import time
+
+from sqlalchemy import Column, MetaData, String, Table, exists, insert, select, update
+
+from .cache import TTLCache
+from .memo import memoize_per_request
+
+
+@lru_cache(maxsize=8192)
+def _student_hash(student_id: str, user_id: Optional[int]) -> str:
+    # Include user_id in hash so same student ID creates different hashes per user
+    hash_input = f"student_{user_id}_{student_id}" if user_id else f"student_{student_id}"
+    return hashlib.sha256(hash_input.encode()).hexdigest()[:16]
+
+
+class StudentEntry(NamedTuple):
+    """Everything a scan needs to know about a rostered student"""
+    name: str
+    banned: bool
+    name_hash: str
 
 
 class RosterService:
-    def __init__(self, db, cipher_suite, student_name_model):
+    def __init__(self, db, cipher_suite, student_name_model, settings_model=None,
+                 unknown_code_ttl: float = 30.0, unknown_code_limit: int = 512,
+                 generation_check_seconds: float = 2.0, on_change=None):
         """
         Initialize RosterService.
         
@@ -15,19 +39,170 @@ class RosterService:
             db: SQLAlchemy database instance
             cipher_suite: Fernet cipher for encryption
             student_name_model: StudentName model class
+            settings_model: Settings model class (holds each user's roster_generation)
+            unknown_code_ttl: Seconds an unknown barcode is remembered as unknown
+            unknown_code_limit: Max unknown barcodes remembered per user
+            generation_check_seconds: How often a worker compares its index
+                against the database's roster_generation
+            on_change: Called with user_id whenever a roster change is staged
+                (bump_generation), before the caller commits
         """
         self.db = db
         self.cipher_suite = cipher_suite
         self.StudentName = student_name_model
-        # Multi-tenant cache: {user_id: {student_id: name}}
+        self.Settings = settings_model
+        # Multi-tenant student index: {user_id: {student_id: StudentEntry}}
         # None as user_id key is for legacy/global mode
-        self._roster_cache: Dict[Optional[int], Dict[str, str]] = {}
+        self._student_index: Dict[Optional[int], Dict[str, StudentEntry]] = {}
+        # Negative cache of codes the database didn't know: {user_id: TTLCache}
+        self.unknown_code_ttl = unknown_code_ttl
+        self.unknown_code_limit = unknown_code_limit
+        self._unknown_codes: Dict[Optional[int], TTLCache] = {}
+        # Cross-worker coherence: roster_generation each index was built from
+        self.generation_check_seconds = generation_check_seconds
+        self._index_generation: Dict[Optional[int], Optional[int]] = {}
+        self._generation_checked_at: Dict[Optional[int], float] = {}
+        # Decrypted IDs from the last build: {user_id: {row_id: (encrypted_id, raw_id)}}
+        # Fernet tokens change whenever an ID is re-encrypted, so an unchanged
+        # token means the row's raw ID can be reused without decrypting again.
+        self._decrypted: Dict[Optional[int], Dict[int, Tuple[str, str]]] = {}
+        self._rebuild_lock = threading.Lock()
+        self.last_rebuild: Optional[Dict[str, Any]] = None
+        self.on_change = on_change
+    
+    def _get_unknown_codes(self, user_id: Optional[int]) -> TTLCache:
+        cache = self._unknown_codes.get(user_id)
+        if cache is None:
+            cache = self._unknown_codes[user_id] = TTLCache(self.unknown_code_limit, self.unknown_code_ttl)
+        return cache
+    
+    def flush_unknown_codes(self, user_id: Optional[int]) -> None:
+        """Forget remembered unknown codes (call whenever the roster changes)"""
+        self._unknown_codes.pop(user_id, None)
+    
+    def _read_generation(self, user_id: Optional[int]) -> Optional[int]:
+        """Current roster_generation for a user (None in legacy mode or if unknown)"""
+        if user_id is None or self.Settings is None:
+            return None
+        try:
+            return self.db.session.query(self.Settings.roster_generation).filter_by(user_id=user_id).scalar()
+        except Exception:
+            return None
     
-    def _get_cache_for_user(self, user_id: Optional[int]) -> Dict[str, str]:
-        """Get the roster cache for a specific user"""
-        if user_id not in self._roster_cache:
-            self._roster_cache[user_id] = {}
-        return self._roster_cache[user_id]
+    def bump_generation(self, user_id: Optional[int]) -> None:
+        """Mark a user's roster as changed for every worker.
+        
+        Runs in the caller's transaction, so it must be followed by the
+        caller's commit alongside the roster change itself.
+        """
+        if self.on_change is not None:
+            self.on_change(user_id)
+        if user_id is None or self.Settings is None:
+            return
+        self.Settings.query.filter_by(user_id=user_id).update(
+            {self.Settings.roster_generation: self.Settings.roster_generation + 1},
+            synchronize_session=False
+        )
+    
+    def expire_generation(self, user_id: Optional[int]) -> None:
+        """Re-check a user's roster_generation on the next lookup (another worker changed it)"""
+        self._generation_checked_at.pop(user_id, None)
+    
+    def _get_index(self, user_id: Optional[int]) -> Dict[str, StudentEntry]:
+        """Get the student index for a user, loading it from the database on first use
+        and rebuilding it when another worker has changed the roster"""
+        index = self._student_index.get(user_id)
+        if index is None:
+            return self.refresh_cache(user_id)
+        if user_id is not None:
+            now = time.monotonic()
+            if now - self._generation_checked_at.get(user_id, 0.0) >= self.generation_check_seconds:
+                self._generation_checked_at[user_id] = now
+                generation = self._read_generation(user_id)
+                if generation is not None and generation != self._index_generation.get(user_id):
+                    index = self.refresh_cache(user_id)
+        return index
+    
+    def _decrypt_id(self, encrypted_id: str) -> Optional[str]:
+        try:
+            return self.cipher_suite.decrypt(encrypted_id.encode()).decode()
+        except Exception:
+            return None
+    
+    def refresh_cache(self, user_id: Optional[int]) -> Dict[str, StudentEntry]:
+        """Rebuild a user's student index from the database.
+        
+        Incremental: only rows whose encrypted_id changed since the last build
+        are decrypted. The new index is swapped in whole, so concurrent
+        lookups see either the old or the new roster, never a partial one.
+        """
+        with self._rebuild_lock:
+            # Read the generation before the rows: a change racing this load
+            # leaves the recorded generation behind and triggers another rebuild
+            generation = self._read_generation(user_id)
+            try:
+                rows = self.db.session.query(
+                    self.StudentName.id, self.StudentName.encrypted_id, self.StudentName.display_name,
+                    self.StudentName.banned, self.StudentName.name_hash
+                ).filter_by(user_id=user_id).all()
+            except Exception:
+                rows = []
+            
+            previous = self._decrypted.get(user_id, {})
+            decrypted: Dict[int, Tuple[str, str]] = {}
+            pending = []
+            for row in rows:
+                # Index is keyed by raw ID, so rows without an encrypted_id can't be scanned
+                if not row.encrypted_id:
+                    continue
+                known = previous.get(row.id)
+                if known and known[0] == row.encrypted_id:
+                    decrypted[row.id] = known
+                else:
+                    pending.append(row)
+            for row in pending:
+                raw_id = self._decrypt_id(row.encrypted_id)
+                if raw_id is not None:
+                    decrypted[row.id] = (row.encrypted_id, raw_id)
+            
+            new_index: Dict[str, StudentEntry] = {}
+            for row in rows:
+                known = decrypted.get(row.id)
+                if known:
+                    new_index[known[1]] = StudentEntry(row.display_name, bool(row.banned), row.name_hash)
+            
+            # Swap in whole so lookups never see a half-built index
+            self._student_index[user_id] = new_index
+            self._decrypted[user_id] = decrypted
+            self._index_generation[user_id] = generation
+            self._generation_checked_at[user_id] = time.monotonic()
+            self.flush_unknown_codes(user_id)
+            self.last_rebuild = {"user_id": user_id, "rows": len(rows), "decrypted": len(pending)}
+            return new_index
+    
+    def get_entry(self, user_id: Optional[int], student_id: str) -> Optional[StudentEntry]:
+        """O(1) lookup of a student's name, ban flag and hash from memory"""
+        return self._get_index(user_id).get(student_id)
+    
+    def update_entry(self, user_id: Optional[int], student_id: str, **changes) -> None:
+        """Patch an indexed student in place (no-op if not indexed)"""
+        index = self._student_index.get(user_id)
+        if index is not None and student_id in index:
+            index[student_id] = index[student_id]._replace(**changes)
+    
+    def update_entry_by_hash(self, user_id: Optional[int], name_hash: str, **changes) -> None:
+        """Patch an indexed student found by name_hash (admin actions only know the hash)"""
+        index = self._student_index.get(user_id)
+        if index is None:
+            return
+        for student_id, entry in index.items():
+            if entry.name_hash == name_hash:
+                index[student_id] = entry._replace(**changes)
+                return
+    
+    def get_roster_size(self, user_id: Optional[int]) -> int:
+        """Number of scannable students for a user"""
+        return len(self._get_index(user_id))
         
     def _hash_student_id(self, student_id: str, user_id: Optional[int] = None) -> str:
         """
@@ -35,21 +210,26 @@ class RosterService:
         Includes user_id in hash for multi-tenant isolation (same student ID 
         can exist for different teachers without conflict).
         """
-        # Include user_id in hash so same student ID creates different hashes per user
-        hash_input = f"student_{user_id}_{student_id}" if user_id else f"student_{student_id}"
-        return hashlib.sha256(hash_input.encode()).hexdigest()[:16]
+        return _student_hash(student_id, user_id)
     
     def get_memory_roster(self, user_id: Optional[int]) -> Dict[str, str]:
-        """Get student roster from memory cache for specific user"""
-        return self._get_cache_for_user(user_id)
+        """Get student roster ({student_id: name}) from memory cache for specific user"""
+        return {sid: entry.name for sid, entry in self._get_index(user_id).items()}
     
     def set_memory_roster(self, user_id: Optional[int], roster_dict: Dict[str, str]) -> None:
-        """Set student roster in memory cache for specific user"""
-        self._roster_cache[user_id] = roster_dict.copy()
+        """Set student roster in memory cache for specific user (ban flags are kept)"""
+        old_index = self._student_index.get(user_id) or {}
+        self._student_index[user_id] = {
+            sid: StudentEntry(name, old_index[sid].banned if sid in old_index else False,
+                              self._hash_student_id(sid, user_id))
+            for sid, name in roster_dict.items()
+        }
+        self.flush_unknown_codes(user_id)
     
     def clear_memory_roster(self, user_id: Optional[int]) -> None:
         """Clear student roster from memory cache for specific user"""
-        self._roster_cache[user_id] = {}
+        self._student_index[user_id] = {}
+        self.flush_unknown_codes(user_id)
     
     def store_student_name(self, user_id: Optional[int], student_id: str, name: str) -> None:
         """Store student name in database using hash for lookup and encryption for retrieval"""
@@ -63,9 +243,11 @@ class RosterService:
                 query = query.filter_by(user_id=user_id)
             
             existing = query.first()
+            banned = False
             if existing:
                 existing.display_name = name
                 existing.encrypted_id = encrypted_id
+                banned = bool(existing.banned)
             else:
                 student_name = self.StudentName(
                     name_hash=name_hash, 
@@ -74,48 +256,95 @@ class RosterService:
                     user_id=user_id  # 2.0: Associate with user
                 )
                 self.db.session.add(student_name)
+            self.bump_generation(user_id)
             self.db.session.commit()
+            index = self._student_index.get(user_id)
+            if index is not None:
+                index[student_id] = StudentEntry(name, banned, name_hash)
+            self.flush_unknown_codes(user_id)
         except Exception:
             try:
                 self.db.session.rollback()
             except Exception:
                 pass
 
-    def store_student_names_batch(self, user_id: Optional[int], roster: dict) -> int:
+    def upsert_rows(self, user_id: Optional[int], rows: List[Dict[str, Any]], chunk_size: int = 500) -> Dict[str, bool]:
+        """
+        Insert or update prepared student_name rows (name_hash, display_name,
+        encrypted_id) in the caller's transaction. Returns {name_hash: banned}.
+        
+        Works set-wise in chunks: one IN-list prefetch of existing hashes, one
+        bulk UPDATE and one bulk INSERT per chunk. Existing records are matched
+        by name_hash alone (including legacy rows) and claimed for this user,
+        which is why ON CONFLICT (user_id, name_hash) can't be used here.
+        """
+        table = self.StudentName.__table__
+        banned_by_hash: Dict[str, bool] = {}
+        for start in range(0, len(rows), chunk_size):
+            chunk = rows[start:start + chunk_size]
+            
+            # Any record with these hashes (including legacy); prefer one already ours
+            existing: Dict[str, Tuple[int, bool]] = {}
+            found = self.db.session.execute(
+                select(table.c.id, table.c.name_hash, table.c.banned, table.c.user_id)
+                .where(table.c.name_hash.in_([row["name_hash"] for row in chunk]))
+                .order_by(table.c.id)
+            ).all()
+            for row_id, name_hash, banned, owner in found:
+                if name_hash not in existing or (user_id is not None and owner == user_id):
+                    existing[name_hash] = (row_id, bool(banned))
+            
+            updates, inserts = [], []
+            for row in chunk:
+                name_hash = row["name_hash"]
+                if name_hash in existing:
+                    # Update existing record, claim it for this user if needed
+                    row_id, banned = existing[name_hash]
+                    values = {"id": row_id, "display_name": row["display_name"], "encrypted_id": row["encrypted_id"]}
+                    if user_id is not None:
+                        values["user_id"] = user_id  # Claim legacy record for this user
+                    updates.append(values)
+                    banned_by_hash[name_hash] = banned
+                else:
+                    inserts.append({"name_hash": name_hash, "display_name": row["display_name"],
+                                    "encrypted_id": row["encrypted_id"], "user_id": user_id})
+                    banned_by_hash[name_hash] = False
+            
+            if updates:
+                # ORM bulk UPDATE by primary key (executemany)
+                self.db.session.execute(update(self.StudentName), updates)
+            if inserts:
+                self.db.session.execute(insert(table), inserts)
+        return banned_by_hash
+    
+    def store_student_names_batch(self, user_id: Optional[int], roster: dict, chunk_size: int = 500) -> int:
         """
         Store multiple student names in database efficiently (single commit).
         Returns the count of successfully stored students.
         Handles legacy data by updating existing records regardless of user_id.
         """
-        stored_count = 0
+        hashes = {student_id: self._hash_student_id(student_id, user_id) for student_id in roster}
+        rows = [{
+            "name_hash": hashes[student_id],
+            "display_name": name,
+            "encrypted_id": self.cipher_suite.encrypt(student_id.encode()).decode(),
+        } for student_id, name in roster.items()]
         try:
-            for student_id, name in roster.items():
-                name_hash = self._hash_student_id(student_id, user_id)
-                encrypted_id = self.cipher_suite.encrypt(student_id.encode()).decode()
-                
-                # First check if any record with this name_hash exists (including legacy)
-                existing = self.StudentName.query.filter_by(name_hash=name_hash).first()
-                
-                if existing:
-                    # Update existing record, claim it for this user if needed
-                    existing.display_name = name
-                    existing.encrypted_id = encrypted_id
-                    if user_id is not None:
-                        existing.user_id = user_id  # Claim legacy record for this user
-                else:
-                    # Create new record
-                    student_name = self.StudentName(
-                        name_hash=name_hash, 
-                        display_name=name, 
-                        encrypted_id=encrypted_id,
-                        user_id=user_id
-                    )
-                    self.db.session.add(student_name)
-                stored_count += 1
+            banned_by_hash = self.upsert_rows(user_id, rows, chunk_size)
             
             # Single commit at the end
+            self.bump_generation(user_id)
             self.db.session.commit()
-            return stored_count
+            
+            # Patch the index in place rather than reloading it
+            index = self._student_index.get(user_id)
+            if index is not None:
+                index.update({
+                    student_id: StudentEntry(name, banned_by_hash[hashes[student_id]], hashes[student_id])
+                    for student_id, name in roster.items()
+                })
+            self.flush_unknown_codes(user_id)
+            return len(rows)
             
         except Exception as e:
             try:
@@ -124,8 +353,8 @@ class RosterService:
                 pass
             raise e  # Re-raise so caller knows it failed
     
-    def get_student_name_from_db(self, user_id: Optional[int], student_id: str) -> Optional[str]:
-        """Get student name from database using hash lookup"""
+    def get_entry_from_db(self, user_id: Optional[int], student_id: str) -> Optional[StudentEntry]:
+        """Get a student's index entry from database using hash lookup"""
         try:
             name_hash = self._hash_student_id(student_id, user_id)
             
@@ -135,27 +364,77 @@ class RosterService:
                 query = query.filter_by(user_id=user_id)
             
             student_name = query.first()
-            return student_name.display_name if student_name else None
+            if not student_name:
+                return None
+            return StudentEntry(student_name.display_name, bool(student_name.banned), name_hash)
         except Exception:
             return None
     
+    def get_student_name_from_db(self, user_id: Optional[int], student_id: str) -> Optional[str]:
+        """Get student name from database using hash lookup"""
+        entry = self.get_entry_from_db(user_id, student_id)
+        return entry.name if entry else None
+    
+    @memoize_per_request("student_name")
     def get_student_name(self, user_id: Optional[int], student_id: str, fallback: str = "Student") -> str:
         """Get student name from memory or database"""
-        # Try memory roster first (fastest)
-        cache = self._get_cache_for_user(user_id)
-        name = cache.get(student_id)
-        if name:
-            return name
+        # Try memory index first (fastest)
+        index = self._get_index(user_id)
+        entry = index.get(student_id)
+        if entry:
+            return entry.name
+        
+        # Recently confirmed unknown (mis-scan, foreign card): skip the database
+        unknown_codes = self._get_unknown_codes(user_id)
+        if unknown_codes.get(student_id):
+            return fallback
         
         # Try database lookup
-        name = self.get_student_name_from_db(user_id, student_id)
-        if name:
+        entry = self.get_entry_from_db(user_id, student_id)
+        if entry:
             # Cache it back to memory
-            cache[student_id] = name
-            return name
+            index[student_id] = entry
+            return entry.name
         
+        unknown_codes.set(student_id, True)
         return fallback
     
+    def get_student_names(self, user_id: Optional[int], student_ids: List[str],
+                          fallback: str = "Student") -> Dict[str, str]:
+        """Resolve many names at once: memory index first, then one database
+        query for whatever it (and the unknown-code cache) doesn't cover"""
+        index = self._get_index(user_id)
+        unknown_codes = self._get_unknown_codes(user_id)
+        names: Dict[str, str] = {}
+        missing: Dict[str, str] = {}
+        for student_id in student_ids:
+            entry = index.get(student_id)
+            if entry:
+                names[student_id] = entry.name
+            elif unknown_codes.get(student_id):
+                names[student_id] = fallback
+            else:
+                missing[self._hash_student_id(student_id, user_id)] = student_id
+
+        if missing:
+            try:
+                query = self.db.session.query(
+                    self.StudentName.name_hash, self.StudentName.display_name, self.StudentName.banned
+                ).filter(self.StudentName.name_hash.in_(list(missing)))
+                if user_id is not None:
+                    query = query.filter_by(user_id=user_id)
+                rows = query.all()
+            except Exception:
+                rows = []
+            for row in rows:
+                student_id = missing.pop(row.name_hash)
+                index[student_id] = StudentEntry(row.display_name, bool(row.banned), row.name_hash)
+                names[student_id] = row.display_name
+            for student_id in missing.values():
+                unknown_codes.set(student_id, True)
+                names[student_id] = fallback
+        return names
+
     def clear_all_student_names(self, user_id: Optional[int]) -> None:
         """Clear all student names from database (scoped to user if set)"""
         try:
@@ -163,6 +442,7 @@ class RosterService:
                 self.StudentName.query.filter_by(user_id=user_id).delete()
             else:
                 self.StudentName.query.delete()
+            self.bump_generation(user_id)
             self.db.session.commit()
             
             # Also clear cache
@@ -180,36 +460,60 @@ class RosterService:
         except Exception:
             return []
     
-    def update_anonymous_students(self, user_id: Optional[int], student_model) -> int:
+    def update_anonymous_students(self, user_id: Optional[int], student_model, chunk_size: int = 1000) -> int:
         """
         Update Student.name for any Anonymous_* entries matching the roster.
         Called after roster upload to retroactively fix anonymous entries.
         Returns the count of updated students.
         
         NOTE (v2.0): Scoped to current user if user_id is set.
+        
+        Runs entirely in the database: each chunk of the tenant's roster is
+        loaded into a temporary table of (code, name) and applied with one
+        correlated UPDATE, so no ORM objects are loaded however many
+        anonymous rows exist.
         """
+        roster = self.get_memory_roster(user_id)
+        if not roster:
+            return 0
+        
+        students = student_model.__table__
+        codes = Table(
+            "tmp_roster_codes", MetaData(),
+            Column("code", String, primary_key=True),
+            Column("name", String, nullable=False),
+            prefixes=["TEMPORARY"],
+        )
+        real_name = select(codes.c.name).where(codes.c.code == students.c.id).scalar_subquery()
+        stmt = (
+            update(students)
+            .where(students.c.name.like('Anonymous_%'))
+            .where(exists().where(codes.c.code == students.c.id, codes.c.name != students.c.name))
+            .values(name=real_name)
+        )
+        if user_id is not None:
+            stmt = stmt.where(students.c.user_id == user_id)
+        
         updated_count = 0
         try:
-            # Build query with optional user_id scoping
-            query = student_model.query.filter(
-                student_model.name.like('Anonymous_%')
-            )
-            if user_id is not None:
-                query = query.filter_by(user_id=user_id)
+            conn = self.db.session.connection()
+            # A temp table left on a pooled connection by a failed call is replaced
+            codes.drop(conn, checkfirst=True)
+            codes.create(conn)
             
-            anonymous_students = query.all()
+            items = list(roster.items())
+            for start in range(0, len(items), chunk_size):
+                if start:
+                    conn.execute(codes.delete())
+                conn.execute(insert(codes), [{"code": code, "name": name}
+                                             for code, name in items[start:start + chunk_size]])
+                updated_count += conn.execute(stmt).rowcount or 0
             
-            for student in anonymous_students:
-                # Check if we have a real name in the roster
-                real_name = self.get_student_name(user_id, student.id, fallback=None)
-                if real_name and real_name != student.name:
-                    student.name = real_name
-                    updated_count += 1
-            
-            if updated_count > 0:
-                self.db.session.commit()
+            codes.drop(conn)
+            self.db.session.commit()
                 
         except Exception:
+            updated_count = 0
             try:
                 self.db.session.rollback()
             except Exception:
@@ -0,0 +1,496 @@
+"""
+Roster Import: Background roster import jobs
+Uploads are saved (encrypted, chunk by chunk) as a job and processed off the
+request thread. The CSV is read as a stream and staged in checkpointed batches, so a job
+interrupted by a worker restart resumes where it stopped. Only a finished
+import is swapped in as the tenant's roster.
+"""
+from datetime import datetime, timezone, timedelta
+from itertools import islice
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import csv
+import io
+import json
+import threading
+import uuid
+
+from sqlalchemy import Boolean, DateTime, Integer, and_, delete, exists, insert, literal, select, update
+
+# Job states
+PENDING = "pending"
+RUNNING = "running"
+COMPLETE = "complete"
+FAILED = "failed"
+
+# Job kinds
+DIFF = "diff"        # /api/roster/upload: the file becomes the whole roster, changing only what differs
+REPLACE = "replace"  # /api/roster/upload?mode=replace: delete the roster and insert the file
+MERGE = "merge"      # /api/upload_session_roster: upsert into the existing roster
+
+
+# Staged encrypted_id of a diff row whose student was already on the roster
+# (kept, not re-encrypted); distinct from None, which means the row has no ID
+ON_ROSTER = ""
+
+
+class _RosterChanged(Exception):
+    """Students staged as already on the roster have since left it"""
+
+
+def _is_id(value: str) -> bool:
+    return bool(value) and all(c.isdigit() for c in value)
+
+
+def parse_roster_row(row: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Return (name, student_id) for a CSV row in either Name,ID or ID,Name order"""
+    col0 = row[0].strip() if len(row) > 0 else ""
+    col1 = row[1].strip() if len(row) > 1 else ""
+
+    # Simple heuristic: IDs are usually numeric. Names are not.
+    if _is_id(col0) and not _is_id(col1):
+        # Format: ID, Name
+        return col1, col0
+    if _is_id(col1) and not _is_id(col0):
+        # Format: Name, ID
+        return col0, col1
+    # Ambiguous or both strings/ints. Fallback to Name, ID default
+    return col0 or None, col1 or None
+
+
+def parse_session_row(row: List[str]) -> Tuple[Optional[str], Optional[str]]:
+    """Return (name, student_id) for a session roster row (strictly ID,Name)"""
+    if len(row) < 2:
+        return None, None
+    student_id, name = row[0].strip(), row[1].strip()
+    if not student_id or not name:
+        return None, None
+    return name, student_id
+
+
+class _ChunkReader(io.RawIOBase):
+    """Readable byte stream over an iterator of byte chunks"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while not self._buffer:
+            self._buffer = next(self._chunks, None)
+            if self._buffer is None:
+                self._buffer = b""
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+
+class RosterImporter:
+    def __init__(self, app, db, cipher_suite, job_model, staging_model, chunk_model, student_name_model,
+                 student_model, roster_service, batch_size: int = 1000, stale_seconds: float = 60.0,
+                 upload_chunk_bytes: int = 256 * 1024,
+                 on_progress: Optional[Callable[[str], None]] = None,
+                 lock_tenant: Optional[Callable[[Optional[int]], None]] = None):
+        """
+        Initialize RosterImporter.
+
+        Args:
+            app: Flask app (jobs run in their own app context)
+            db: SQLAlchemy database instance
+            cipher_suite: Fernet cipher for encryption
+            job_model: RosterImportJob model class
+            staging_model: RosterImportRow model class
+            chunk_model: RosterImportChunk model class (the encrypted upload)
+            student_name_model: StudentName model class
+            student_model: Student model class (anonymous fix-up after merges)
+            roster_service: RosterService
+            batch_size: CSV rows parsed, encrypted and committed per checkpoint
+            stale_seconds: How long a running job may go without a heartbeat
+                before another worker takes it over
+            upload_chunk_bytes: Upload bytes read, encrypted and stored at a time
+            on_progress: Called with a job id inside each transaction that
+                checkpoints the job (e.g. to announce it after commit)
+            lock_tenant: Called with a user id to serialize the apply with the
+                tenant's other roster changes until the transaction ends
+        """
+        self.app = app
+        self.db = db
+        self.cipher_suite = cipher_suite
+        self.Job = job_model
+        self.Staging = staging_model
+        self.Chunk = chunk_model
+        self.StudentName = student_name_model
+        self.Student = student_model
+        self.roster_service = roster_service
+        self.batch_size = batch_size
+        self.stale_seconds = stale_seconds
+        self.upload_chunk_bytes = upload_chunk_bytes
+        self.on_progress = on_progress
+        self.lock_tenant = lock_tenant
+        # {job_id: Event} for jobs running in this worker, set and dropped when they finish
+        self._done: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    # ---------- Job lifecycle ----------
+
+    def create_job(self, user_id: Optional[int], kind: str, stream):
+        """Save an uploaded CSV (a binary file object) as a pending job (committed).
+
+        The upload is read, encrypted and written one chunk at a time, so only
+        a chunk of it is ever held in memory.
+        """
+        now = datetime.now(timezone.utc)
+        job = self.Job(
+            id=uuid.uuid4().hex,
+            user_id=user_id,
+            kind=kind,
+            status=PENDING,
+            created_at=now,
+            heartbeat_at=now,
+        )
+        self.db.session.add(job)
+        self.db.session.flush()
+        chunks = self.Chunk.__table__
+        for seq, data in enumerate(iter(lambda: stream.read(self.upload_chunk_bytes), b"")):
+            self.db.session.execute(insert(chunks).values(
+                job_id=job.id, seq=seq, data=self.cipher_suite.encrypt(data).decode()))
+        self.db.session.commit()
+        return job
+
+    def start(self, job_id: str, stale_only: bool = False) -> bool:
+        """Run a job in a background thread if this worker can claim it"""
+        lease = self._claim(job_id, stale_only)
+        if lease is None:
+            return False
+        with self._lock:
+            self._done.setdefault(job_id, threading.Event())
+        threading.Thread(target=self._run, args=(job_id, lease), daemon=True,
+                         name=f"roster-import-{job_id[:8]}").start()
+        return True
+
+    def wait(self, job_id: str, timeout: float) -> bool:
+        """Block until a job running in this worker finishes; False on timeout
+        (or if it isn't running here, e.g. already finished)"""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is None:
+            return False
+        return done.wait(timeout)
+
+    def resume_stale(self, job_id: Optional[str] = None) -> int:
+        """Take over unfinished jobs whose worker stopped heartbeating"""
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=self.stale_seconds)
+        query = self.db.session.query(self.Job.id).filter(
+            self.Job.status.in_([PENDING, RUNNING]),
+            self.Job.heartbeat_at < cutoff,
+        )
+        if job_id is not None:
+            query = query.filter(self.Job.id == job_id)
+        resumed = 0
+        for (stale_id,) in query.all():
+            if self.start(stale_id, stale_only=True):
+                resumed += 1
+        return resumed
+
+    def _claim(self, job_id: str, stale_only: bool) -> Optional[str]:
+        """Atomically take ownership of a job; returns the lease or None"""
+        now = datetime.now(timezone.utc)
+        table = self.Job.__table__
+        stmt = update(table).where(table.c.id == job_id)
+        if stale_only:
+            cutoff = now - timedelta(seconds=self.stale_seconds)
+            stmt = stmt.where(table.c.status.in_([PENDING, RUNNING]), table.c.heartbeat_at < cutoff)
+        else:
+            stmt = stmt.where(table.c.status == PENDING)
+        lease = uuid.uuid4().hex
+        claimed = self.db.session.execute(
+            stmt.values(status=RUNNING, lease=lease, heartbeat_at=now)
+        ).rowcount
+        self.db.session.commit()
+        return lease if claimed == 1 else None
+
+    def _checkpoint(self, job_id: str, lease: str, **values) -> bool:
+        """Record progress and heartbeat (in the current transaction) if we still hold the lease"""
+        table = self.Job.__table__
+        held = self.db.session.execute(
+            update(table)
+            .where(table.c.id == job_id, table.c.lease == lease)
+            .values(heartbeat_at=datetime.now(timezone.utc), **values)
+        ).rowcount == 1
+        if held and self.on_progress is not None:
+            self.on_progress(job_id)
+        return held
+
+    def _run(self, job_id: str, lease: str) -> None:
+        with self.app.app_context():
+            try:
+                job = self.db.session.get(self.Job, job_id)
+                if self._stage(job, lease):
+                    try:
+                        self._apply(job, lease)
+                    except _RosterChanged:
+                        # Stage again with every ID encrypted, which can't go stale
+                        self.db.session.rollback()
+                        if self._restart(job, lease) and self._stage(job, lease, encrypt_all=True):
+                            self._apply(job, lease)
+            except Exception as e:
+                self.db.session.rollback()
+                try:
+                    self._fail(job_id, lease, str(e) or type(e).__name__)
+                except Exception:
+                    self.db.session.rollback()
+            finally:
+                self.db.session.remove()
+                # Waiters hold their own reference; a later wait() falls back to 202
+                with self._lock:
+                    done = self._done.pop(job_id, None)
+                if done is not None:
+                    done.set()
+
+    def _fail(self, job_id: str, lease: str, error: str) -> None:
+        self.db.session.execute(delete(self.Staging.__table__).where(self.Staging.__table__.c.job_id == job_id))
+        self.db.session.execute(delete(self.Chunk.__table__).where(self.Chunk.__table__.c.job_id == job_id))
+        self._checkpoint(job_id, lease, status=FAILED, error=error, payload=None,
+                         finished_at=datetime.now(timezone.utc))
+        self.db.session.commit()
+
+    def _restart(self, job, lease: str) -> bool:
+        """Drop a job's staged rows and rewind it to the start of its upload"""
+        staging = self.Staging.__table__
+        self.db.session.execute(delete(staging).where(staging.c.job_id == job.id))
+        if not self._checkpoint(job.id, lease, checkpoint=0, rows_parsed=0, rows_encrypted=0,
+                                rows_stored=0, rows_failed=0):
+            self.db.session.rollback()
+            return False
+        self.db.session.commit()
+        return True
+
+    # ---------- Staging ----------
+
+    def _upload(self, job) -> Iterator[bytes]:
+        """The job's uploaded CSV, decrypted a chunk at a time"""
+        if job.payload:
+            # Saved whole, before uploads were stored in chunks
+            yield self.cipher_suite.decrypt(job.payload.encode())
+        chunks = self.Chunk.__table__
+        seq = 0
+        while True:
+            data = self.db.session.execute(
+                select(chunks.c.data).where(chunks.c.job_id == job.id, chunks.c.seq == seq)
+            ).scalar()
+            if data is None:
+                return
+            yield self.cipher_suite.decrypt(data.encode())
+            seq += 1
+
+    def build_row(self, user_id: Optional[int], name: str, student_id: Optional[str], hash_source: str,
+                  known_hashes: frozenset = frozenset()) -> Dict[str, Any]:
+        """Hash and encrypt one student into a student_name row.
+
+        Students whose hash is in known_hashes already have an encrypted ID
+        on file, so encryption is skipped for them (encrypted_id is ON_ROSTER).
+        Rows without a student_id get None.
+        """
+        name_hash = self.roster_service._hash_student_id(hash_source, user_id)
+        if not student_id:
+            encrypted_id = None
+        elif name_hash in known_hashes:
+            encrypted_id = ON_ROSTER
+        else:
+            encrypted_id = self.cipher_suite.encrypt(student_id.encode()).decode()
+        return {"display_name": name, "name_hash": name_hash, "encrypted_id": encrypted_id}
+
+    def _stage(self, job, lease: str, encrypt_all: bool = False) -> bool:
+        """
+        Parse, encrypt and stage the job's CSV in checkpointed batches.
+
+        Each batch commits its staged rows together with the job's counters
+        and checkpoint (CSV records consumed), so a resumed job skips exactly
+        the records already staged. Returns False if the lease was lost.
+        encrypt_all encrypts diff rows already on the roster too.
+        """
+        staging = self.Staging.__table__
+        parse = parse_session_row if job.kind == MERGE else parse_roster_row
+        upload = io.BufferedReader(_ChunkReader(self._upload(job)))
+        reader = csv.reader(io.TextIOWrapper(upload, encoding="utf-8-sig", errors="ignore", newline=""))
+
+        # Duplicate IDs keep their first row, including across a resume
+        seen = set(self.db.session.execute(
+            select(staging.c.name_hash).where(staging.c.job_id == job.id)
+        ).scalars())
+        # A diff only needs encrypted IDs for students not already on the roster
+        known_hashes = frozenset()
+        if job.kind == DIFF and not encrypt_all:
+            students = self.StudentName.__table__
+            known_hashes = frozenset(self.db.session.execute(
+                select(students.c.name_hash).where(students.c.user_id == job.user_id)
+            ).scalars())
+        counters = {
+            "checkpoint": job.checkpoint or 0,
+            "rows_parsed": job.rows_parsed or 0,
+            "rows_encrypted": job.rows_encrypted or 0,
+            "rows_stored": job.rows_stored or 0,
+            "rows_failed": job.rows_failed or 0,
+        }
+        batch: List[Dict[str, Any]] = []
+
+        def flush() -> bool:
+            if batch:
+                self.db.session.execute(insert(staging), batch)
+            if not self._checkpoint(job.id, lease, **counters):
+                self.db.session.rollback()
+                return False
+            self.db.session.commit()
+            batch.clear()
+            return True
+
+        for record in islice(reader, counters["checkpoint"], None):
+            counters["checkpoint"] += 1
+            if record:
+                counters["rows_parsed"] += 1
+                name, student_id = parse(record)
+                # Rows without an ID fall back to their position for a stable hash
+                hash_source = student_id or f"row_{counters['rows_stored']}"
+                row = self.build_row(job.user_id, name, student_id, hash_source, known_hashes) if name else None
+                if row is None or row["name_hash"] in seen:
+                    counters["rows_failed"] += 1
+                else:
+                    seen.add(row["name_hash"])
+                    row["job_id"] = job.id
+                    batch.append(row)
+                    counters["rows_encrypted"] += 1 if row["encrypted_id"] else 0
+                    counters["rows_stored"] += 1
+            if counters["checkpoint"] % self.batch_size == 0 and not flush():
+                return False
+        return flush()
+
+    # ---------- Apply ----------
+
+    def _apply(self, job, lease: str) -> None:
+        """Swap the staged rows in as the tenant's roster and finish the job"""
+        staging = self.Staging.__table__
+        user_id = job.user_id
+        result: Dict[str, Any] = {"count": job.rows_stored, "failed": job.rows_failed}
+        if self.lock_tenant is not None:
+            self.lock_tenant(user_id)
+
+        if job.kind == DIFF:
+            result.update(self._apply_diff(job))
+        elif job.kind == REPLACE:
+            # One transaction: readers see the old roster until the new one is complete
+            self.StudentName.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+            students = self.StudentName.__table__
+            self.db.session.execute(insert(students).from_select(
+                ["display_name", "name_hash", "encrypted_id", "user_id", "banned", "created_at"],
+                select(
+                    staging.c.display_name, staging.c.name_hash, staging.c.encrypted_id,
+                    literal(user_id, Integer), literal(False, Boolean),
+                    literal(datetime.now(timezone.utc), DateTime(timezone=True)),
+                ).where(staging.c.job_id == job.id).order_by(staging.c.id)
+            ))
+        else:
+            # Upsert in keyset-paged chunks, then fix up anonymous entries
+            last_id = 0
+            while True:
+                rows = self.db.session.execute(
+                    select(staging.c.id, staging.c.name_hash, staging.c.display_name, staging.c.encrypted_id)
+                    .where(staging.c.job_id == job.id, staging.c.id > last_id)
+                    .order_by(staging.c.id).limit(self.batch_size)
+                ).mappings().all()
+                if not rows:
+                    break
+                last_id = rows[-1]["id"]
+                self.roster_service.upsert_rows(user_id, [dict(r) for r in rows])
+            self.roster_service.bump_generation(user_id)
+            if not self._checkpoint(job.id, lease):
+                self.db.session.rollback()
+                return
+            self.db.session.commit()
+            self.roster_service.refresh_cache(user_id)
+            # Re-running the upsert and fix-up after a crash here is harmless
+            result["updated_anonymous"] = self.roster_service.update_anonymous_students(user_id, self.Student)
+
+        finished_at = datetime.now(timezone.utc)
+        created_at = job.created_at if job.created_at.tzinfo else job.created_at.replace(tzinfo=timezone.utc)
+        seconds = max((finished_at - created_at).total_seconds(), 0.001)
+        result["seconds"] = round(seconds, 3)
+        result["rows_per_second"] = int(job.rows_parsed / seconds)
+
+        if job.kind != MERGE:
+            self.roster_service.bump_generation(user_id)
+        self.db.session.execute(delete(staging).where(staging.c.job_id == job.id))
+        self.db.session.execute(delete(self.Chunk.__table__).where(self.Chunk.__table__.c.job_id == job.id))
+        if not self._checkpoint(job.id, lease, status=COMPLETE, payload=None,
+                                result=json.dumps(result), finished_at=finished_at):
+            self.db.session.rollback()
+            return
+        self.db.session.commit()
+        self.roster_service.refresh_cache(user_id)
+
+    def _apply_diff(self, job) -> Dict[str, int]:
+        """
+        Make the tenant's roster match the staged rows, touching only what differs
+        (in the caller's transaction).
+
+        Students missing from the file are deleted, renamed ones get their new
+        display name, and new ones are inserted. Everyone who remains keeps
+        their row, encrypted ID and ban flag.
+
+        Raises _RosterChanged if a student staged without an encrypted ID
+        (already on the roster at staging time) has since been removed.
+        """
+        staging = self.Staging.__table__
+        students = self.StudentName.__table__
+        staged = and_(staging.c.job_id == job.id, staging.c.name_hash == students.c.name_hash)
+        ours = students.c.user_id == job.user_id
+
+        # Checked under the tenant lock, so the roster can't change before the insert
+        gone = self.db.session.execute(
+            select(staging.c.id).where(
+                staging.c.job_id == job.id, staging.c.encrypted_id == ON_ROSTER,
+                ~exists().where(students.c.name_hash == staging.c.name_hash, ours),
+            ).limit(1)
+        ).first()
+        if gone is not None:
+            raise _RosterChanged()
+
+        removed = self.db.session.execute(
+            delete(students).where(ours, ~exists().where(staged))
+        ).rowcount
+        changed = self.db.session.execute(
+            update(students)
+            .where(ours, exists().where(staged, staging.c.display_name != students.c.display_name))
+            .values(display_name=select(staging.c.display_name).where(staged).scalar_subquery())
+        ).rowcount
+        added = self.db.session.execute(insert(students).from_select(
+            ["display_name", "name_hash", "encrypted_id", "user_id", "banned", "created_at"],
+            select(
+                staging.c.display_name, staging.c.name_hash, staging.c.encrypted_id,
+                literal(job.user_id, Integer), literal(False, Boolean),
+                literal(datetime.now(timezone.utc), DateTime(timezone=True)),
+            ).where(
+                staging.c.job_id == job.id,
+                ~exists().where(students.c.name_hash == staging.c.name_hash, ours),
+            ).order_by(staging.c.id)
+        )).rowcount
+        return {"added": added, "changed": changed, "removed": removed}
+
+    # ---------- Progress ----------
+
+    def progress(self, job) -> Dict[str, Any]:
+        """Client-facing view of a job"""
+        return {
+            "job_id": job.id,
+            "kind": job.kind,
+            "status": job.status,
+            "rows_parsed": job.rows_parsed or 0,
+            "rows_encrypted": job.rows_encrypted or 0,
+            "rows_stored": job.rows_stored or 0,
+            "rows_failed": job.rows_failed or 0,
+            "result": json.loads(job.result) if job.result else None,
+            "error": job.error,
+        }
@@ -5,6 +5,8 @@ Refactored for 2.0 multi-tenancy with stateless user_id scoping
 from typing import Optional, List
 from datetime import datetime, timezone
 
+from .memo import memoize_per_request
+
 
 class SessionService:
     def __init__(self, db, session_model):
@@ -18,6 +20,7 @@ class SessionService:
         self.db = db
         self.Session = session_model
     
+    @memoize_per_request("open_sessions")
     def get_open_sessions(self, user_id: Optional[int]) -> List:
         """Get all currently open sessions (scoped to user if set)"""
         try:
@@ -0,0 +1,107 @@
+"""
+Settings Service: Per-tenant settings with a write-through cache
+Refactored for 2.0 multi-tenancy with stateless user_id scoping
+"""
+from typing import Dict, Optional, Any
+import threading
+import time
+
+from sqlalchemy import func, inspect
+
+
+class SettingsService:
+    def __init__(self, db, settings_model, defaults: Dict[str, Any], revalidate_seconds: float = 2.0,
+                 on_change=None):
+        """
+        Initialize SettingsService.
+
+        Args:
+            db: SQLAlchemy database instance
+            settings_model: Settings model class
+            defaults: Settings returned when there is no tenant (legacy/anonymous)
+            revalidate_seconds: How long a cached copy is trusted before its
+                version stamp is re-checked against the database
+            on_change: Called with user_id before a settings change is committed
+        """
+        self.db = db
+        self.Settings = settings_model
+        self.defaults = defaults
+        self.revalidate_seconds = revalidate_seconds
+        # {user_id: (settings_dict, version, checked_at)}
+        self._cache: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self.on_change = on_change
+
+    def _to_dict(self, s) -> Dict[str, Any]:
+        """Serialize a Settings row (tolerates columns missing mid-migration)"""
+        return {
+            "room_name": s.room_name,
+            "capacity": s.capacity,
+            "overdue_minutes": s.overdue_minutes,
+            "kiosk_suspended": getattr(s, 'kiosk_suspended', False),
+            "auto_ban_overdue": getattr(s, 'auto_ban_overdue', False),
+            "enable_queue": getattr(s, 'enable_queue', False),
+            "auto_promote_queue": getattr(s, 'auto_promote_queue', False)
+        }
+
+    def _store(self, user_id: int, s) -> Dict[str, Any]:
+        data = self._to_dict(s)
+        with self._lock:
+            self._cache[user_id] = (data, s.version or 0, time.monotonic())
+        return data
+
+    def get_row(self, user_id: int, **overrides):
+        """Get the tenant's Settings row, adding a default one (uncommitted) if missing"""
+        s = self.Settings.query.filter_by(user_id=user_id).first()
+        if not s:
+            # Create default settings for this user (isolated from all others)
+            values = dict(room_name="Hall Pass", capacity=1, overdue_minutes=10,
+                          kiosk_suspended=False, auto_ban_overdue=False, version=0)
+            values.update(overrides)
+            s = self.Settings(user_id=user_id, **values)
+            self.db.session.add(s)
+        return s
+
+    def get_settings(self, user_id: Optional[int]) -> Dict[str, Any]:
+        """Get settings for a tenant, served from cache while its version is current"""
+        if user_id is None:
+            # Legacy/anonymous: return defaults only (don't create or use global)
+            return dict(self.defaults)
+
+        cached = self._cache.get(user_id)
+        if cached:
+            data, version, checked_at = cached
+            if time.monotonic() - checked_at < self.revalidate_seconds:
+                return dict(data)
+            # Cheap staleness check: another worker may have written since
+            current = self.db.session.query(self.Settings.version).filter_by(user_id=user_id).scalar()
+            if current is not None and current == version:
+                with self._lock:
+                    self._cache[user_id] = (data, version, time.monotonic())
+                return dict(data)
+
+        s = self.Settings.query.filter_by(user_id=user_id).first()
+        if not s:
+            s = self.get_row(user_id)
+            self.db.session.commit()
+        return dict(self._store(user_id, s))
+
+    def commit(self, user_id: int, s) -> Dict[str, Any]:
+        """Commit changes to a Settings row, bumping its version and writing through"""
+        if inspect(s).persistent:
+            # Increment in SQL so concurrent writers in other workers never reuse a stamp
+            s.version = func.coalesce(self.Settings.version, 0) + 1
+        else:
+            s.version = (s.version or 0) + 1
+        if self.on_change is not None:
+            self.on_change(user_id)
+        self.db.session.commit()
+        return dict(self._store(user_id, s))
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drop one tenant's cached settings (or all of them)"""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(user_id, None)
@@ -0,0 +1,263 @@
+"""
+Stats Service: Pass analytics aggregated in the database
+Sessions are bucketed by local hour and local date with GROUP BY queries, so
+each series costs one query however many rows or days it covers. The
+UTC-to-local conversion happens in SQL: AT TIME ZONE on PostgreSQL, and on
+SQLite (no time zone database) an offset expression built from the zone's
+UTC offsets over the requested window, DST changes included.
+
+Closed sessions are also kept pre-aggregated in a per-student, per-local-day
+rollup, updated in the transaction that ends each session. Day and student
+series read the rollup (plus the few still-open sessions), so their cost
+follows the number of students and days rather than the length of history.
+"""
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Tuple
+import heapq
+
+from sqlalchemy import Date, Integer, case, cast, extract, func, literal
+
+
+class StatsService:
+    def __init__(self, db, session_model, rollup_model, tz):
+        """
+        Initialize StatsService.
+
+        Args:
+            db: SQLAlchemy database instance
+            session_model: Session model class
+            rollup_model: SessionDailyRollup model class
+            tz: Local timezone (ZoneInfo) that hours and dates are counted in
+        """
+        self.db = db
+        self.Session = session_model
+        self.Rollup = rollup_model
+        self.tz = tz
+
+    # ---------- Local time expressions ----------
+
+    def day_bounds(self, first_day: date, last_day: date) -> Tuple[datetime, datetime]:
+        """UTC instants covering whole local days first_day..last_day (end exclusive)"""
+        start = datetime.combine(first_day, time.min, tzinfo=self.tz).astimezone(timezone.utc)
+        end = datetime.combine(last_day + timedelta(days=1), time.min, tzinfo=self.tz).astimezone(timezone.utc)
+        return start, end
+
+    def _offsets(self, start_utc: datetime, end_utc: datetime) -> List[Tuple[datetime, int]]:
+        """(utc_instant, offset_seconds) for the window start and every offset change in it"""
+        def offset(at: datetime) -> int:
+            return int(at.astimezone(self.tz).utcoffset().total_seconds())
+
+        changes = [(start_utc, offset(start_utc))]
+        day = start_utc
+        while day < end_utc:
+            next_day = min(day + timedelta(days=1), end_utc)
+            if offset(next_day) != changes[-1][1]:
+                # Find the change within the day to the quarter hour
+                step = day
+                while step < next_day:
+                    step = step + timedelta(minutes=15)
+                    if offset(step) != changes[-1][1]:
+                        changes.append((step, offset(step)))
+                        break
+            day = next_day
+        return changes
+
+    def local_ts(self, column, start_utc: datetime, end_utc: datetime):
+        """SQL expression for a UTC timestamp column as local wall-clock time.
+
+        start_utc/end_utc bound the rows the expression will see; the SQLite
+        form is only exact inside that window.
+        """
+        if self.db.engine.dialect.name == "postgresql":
+            return func.timezone(self.tz.key, column)
+        changes = self._offsets(start_utc, end_utc)
+        if len(changes) == 1:
+            modifier = literal(f"{changes[0][1]:+d} seconds")
+        else:
+            modifier = case(
+                *[(column < at, f"{previous:+d} seconds")
+                  for (at, _), (_, previous) in zip(changes[1:], changes)],
+                else_=f"{changes[-1][1]:+d} seconds",
+            )
+        return func.datetime(column, modifier)
+
+    def local_hour(self, column, start_utc: datetime, end_utc: datetime):
+        local = self.local_ts(column, start_utc, end_utc)
+        if self.db.engine.dialect.name == "postgresql":
+            return cast(extract("hour", local), Integer)
+        return cast(func.strftime("%H", local), Integer)
+
+    def local_date(self, column, start_utc: datetime, end_utc: datetime):
+        local = self.local_ts(column, start_utc, end_utc)
+        if self.db.engine.dialect.name == "postgresql":
+            return cast(local, Date)
+        return func.date(local)
+
+    @staticmethod
+    def as_date(value) -> date:
+        """Normalize a local_date() result (date on PostgreSQL, 'YYYY-MM-DD' on SQLite)"""
+        return value if isinstance(value, date) else date.fromisoformat(str(value)[:10])
+
+    # ---------- Series ----------
+
+    def _scoped(self, query, user_id: Optional[int], start_utc: datetime, end_utc: datetime):
+        query = query.filter(self.Session.start_ts >= start_utc, self.Session.start_ts < end_utc)
+        if user_id is not None:
+            query = query.filter(self.Session.user_id == user_id)
+        return query
+
+    def hourly_counts(self, user_id: Optional[int], day: date) -> List[int]:
+        """Sessions started in each local hour of a day (one query)"""
+        start, end = self.day_bounds(day, day)
+        hour = self.local_hour(self.Session.start_ts, start, end).label("hour")
+        rows = self._scoped(self.db.session.query(hour, func.count(self.Session.id)), user_id, start, end) \
+            .group_by(hour).all()
+        hourly = [0] * 24
+        for h, count in rows:
+            if h is not None and 0 <= int(h) < 24:
+                hourly[int(h)] += count
+        return hourly
+
+    def daily_counts(self, user_id: Optional[int], first_day: date, last_day: date) -> Dict[date, int]:
+        """Sessions started on each local day first_day..last_day (every day present)"""
+        counts = {first_day + timedelta(days=i): 0 for i in range((last_day - first_day).days + 1)}
+        rows = self._rollups(self.db.session.query(self.Rollup.local_date, func.sum(self.Rollup.count)),
+                             user_id, first_day, last_day).group_by(self.Rollup.local_date).all()
+        for value, count in rows:
+            d = self.as_date(value)
+            if d in counts:
+                counts[d] += int(count)
+        for _student_id, start_ts in self._open_sessions(user_id, first_day, last_day):
+            d = start_ts.astimezone(self.tz).date()
+            if d in counts:
+                counts[d] += 1
+        return counts
+
+    def student_usage(self, user_id: Optional[int], first_day: Optional[date], last_day: Optional[date],
+                      overdue_seconds: int, now: datetime) -> List[Dict[str, Any]]:
+        """Per-student pass count, overdue count and overdue rate over whole local
+        days first_day..last_day, or all time when they're None (names not resolved).
+
+        Closed passes count as overdue by the threshold in force when they
+        ended; open ones by overdue_seconds.
+        """
+        rows = self._rollups(
+            self.db.session.query(self.Rollup.student_id, func.sum(self.Rollup.count),
+                                  func.sum(self.Rollup.overdue_count)),
+            user_id, first_day, last_day
+        ).group_by(self.Rollup.student_id).all()
+        usage: Dict[str, List[int]] = {student_id: [int(count), int(overdues or 0)]
+                                       for student_id, count, overdues in rows}
+        for student_id, start_ts in self._open_sessions(user_id, first_day, last_day):
+            entry = usage.setdefault(student_id, [0, 0])
+            entry[0] += 1
+            # Same rule as whole-second durations: overdue once int(duration) > threshold
+            if int((now - start_ts).total_seconds()) > overdue_seconds:
+                entry[1] += 1
+        return [{
+            "student_id": student_id,
+            "count": count,
+            "overdue": overdues,
+            "overdue_rate": (overdues / count) if count else 0,
+        } for student_id, (count, overdues) in usage.items()]
+
+    @staticmethod
+    def top(usage: List[Dict[str, Any]], key: str, n: int) -> List[Dict[str, Any]]:
+        return heapq.nlargest(n, usage, key=lambda row: row[key])
+
+    # ---------- Daily rollup ----------
+
+    @staticmethod
+    def rollup_key(user_id: Optional[int]) -> int:
+        """Rollup rows of sessions without a tenant (legacy) are stored under 0"""
+        return user_id or 0
+
+    def _rollups(self, query, user_id: Optional[int], first_day: Optional[date], last_day: Optional[date]):
+        if first_day is not None:
+            query = query.filter(self.Rollup.local_date >= first_day)
+        if last_day is not None:
+            query = query.filter(self.Rollup.local_date <= last_day)
+        if user_id is not None:
+            query = query.filter(self.Rollup.user_id == self.rollup_key(user_id))
+        return query
+
+    def _open_sessions(self, user_id: Optional[int], first_day: Optional[date],
+                       last_day: Optional[date]) -> List[Tuple[str, datetime]]:
+        """(student_id, start_ts) of open sessions started in the window; not yet in the rollup"""
+        query = self.db.session.query(self.Session.student_id, self.Session.start_ts) \
+            .filter(self.Session.end_ts.is_(None))
+        if first_day is not None:
+            query = query.filter(self.Session.start_ts >= self.day_bounds(first_day, first_day)[0])
+        if last_day is not None:
+            query = query.filter(self.Session.start_ts < self.day_bounds(last_day, last_day)[1])
+        if user_id is not None:
+            query = query.filter(self.Session.user_id == user_id)
+        return [(student_id, start_ts) for student_id, start_ts in query]
+
+    def record_end(self, sess, overdue_seconds: int) -> None:
+        """Add a just-ended session to its day's rollup row.
+
+        Runs in the caller's transaction (never commits), so the rollup
+        changes exactly when the session end does.
+        """
+        duration = int((sess.end_ts - sess.start_ts).total_seconds())
+        table = self.Rollup.__table__
+        if self.db.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        stmt = insert(table).values(
+            user_id=self.rollup_key(sess.user_id),
+            student_id=sess.student_id,
+            local_date=sess.start_ts.astimezone(self.tz).date(),
+            count=1,
+            total_seconds=duration,
+            overdue_count=1 if duration > overdue_seconds else 0,
+            max_seconds=duration,
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id, table.c.student_id, table.c.local_date],
+            set_={
+                "count": table.c.count + stmt.excluded.count,
+                "total_seconds": table.c.total_seconds + stmt.excluded.total_seconds,
+                "overdue_count": table.c.overdue_count + stmt.excluded.overdue_count,
+                "max_seconds": case((stmt.excluded.max_seconds > table.c.max_seconds, stmt.excluded.max_seconds),
+                                    else_=table.c.max_seconds),
+            },
+        )
+        self.db.session.execute(stmt)
+
+    def clear_rollups(self, user_id: Optional[int]) -> int:
+        """Delete a tenant's rollup rows (caller commits)"""
+        return self.Rollup.query.filter_by(user_id=self.rollup_key(user_id)).delete()
+
+    def rebuild_rollups(self, user_id: Optional[int], overdue_seconds: int) -> int:
+        """Recompute a tenant's rollup from its closed sessions (caller commits).
+
+        Every pass is judged against overdue_seconds, today's threshold.
+        Returns the number of rollup rows written.
+        """
+        self.clear_rollups(user_id)
+        # Tenant-less (legacy) sessions share key 0, so None means user_id IS NULL here
+        closed = self.db.session.query(self.Session) \
+            .filter(self.Session.end_ts.isnot(None), self.Session.user_id == user_id)
+        first, last = closed.with_entities(func.min(self.Session.start_ts), func.max(self.Session.start_ts)).one()
+        if first is None:
+            return 0
+        # Bounds for the SQLite offset expression, padded past either end
+        start = first - timedelta(days=1)
+        end = last + timedelta(days=1)
+        day = self.local_date(self.Session.start_ts, start, end).label("local_date")
+        now = datetime.now(timezone.utc)
+        seconds = self.Session.duration_at(now)
+        select = closed.with_entities(
+            literal(self.rollup_key(user_id)), self.Session.student_id, day,
+            func.count(self.Session.id), func.sum(seconds),
+            func.sum(case((self.Session.is_overdue(overdue_seconds, now), 1), else_=0)), func.max(seconds),
+        ).group_by(self.Session.student_id, day)
+        table = self.Rollup.__table__
+        result = self.db.session.execute(table.insert().from_select(
+            ["user_id", "student_id", "local_date", "count", "total_seconds", "overdue_count", "max_seconds"],
+            select.statement,
+        ))
+        return result.rowcount
@@ -0,0 +1,190 @@
+"""
+Status Service: One consistent read of a tenant's live state
+/api/status, /events and the admin dashboard all render from the same
+snapshot: one query for open sessions, one for the queue and one batched
+name lookup. Snapshots are cached per tenant for a fraction of a second so
+bursts of polls share a single read.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+import threading
+import time
+
+
+class OpenSession(NamedTuple):
+    id: int
+    student_id: str
+    start_ts: datetime
+
+
+class StatusSnapshot:
+    """A tenant's settings, open sessions, queue and names at one point in time.
+
+    Holds plain values only (no ORM instances), so it can outlive the request
+    that built it. Durations are computed at render time from one `now`.
+    """
+
+    def __init__(self, settings: Dict[str, Any], sessions: List[OpenSession], queue: List[str],
+                 names: Dict[str, str], tz, version: Optional[int] = None):
+        self.settings = settings
+        self.sessions = sessions
+        self.queue = queue
+        self.names = names
+        self.tz = tz
+        self.version = version
+
+    def name(self, student_id: str, fallback: str = "Student") -> str:
+        return self.names.get(student_id) or fallback
+
+    def timing(self, sess: OpenSession, now: datetime) -> Dict[str, Any]:
+        """Absolute timing for an open session. Clients derive elapsed time from
+        these, so the values only change when the session itself does."""
+        overdue_seconds = self.settings["overdue_minutes"] * 60
+        start = sess.start_ts.astimezone(self.tz)
+        return {
+            "start": start.isoformat(),
+            "overdue_at": (start + timedelta(seconds=overdue_seconds)).isoformat(),
+            "overdue": (now - sess.start_ts).total_seconds() > overdue_seconds,
+        }
+
+    def overdue_deadlines(self) -> List[datetime]:
+        """Instants after which each open session counts as overdue"""
+        overdue_seconds = self.settings["overdue_minutes"] * 60
+        return [sess.start_ts + timedelta(seconds=overdue_seconds) for sess in self.sessions]
+
+    def queue_list(self) -> List[Dict[str, str]]:
+        # student_id is what Queue stores, which /api/queue/delete expects back
+        return [{"name": self.name(sid, "Unknown"), "student_id": sid} for sid in self.queue]
+
+    def _common(self) -> Dict[str, Any]:
+        settings = self.settings
+        return {
+            "overdue_minutes": settings["overdue_minutes"],
+            "kiosk_suspended": settings["kiosk_suspended"],
+            "auto_ban_overdue": settings.get("auto_ban_overdue", False),
+            "auto_promote_queue": settings.get("auto_promote_queue", False),
+            # Multi-pass support
+            "capacity": settings["capacity"],
+        }
+
+    def to_event(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Payload pushed to /events subscribers.
+
+        Time-invariant apart from the overdue flags: sessions carry absolute
+        start and overdue_at times rather than elapsed seconds, so an
+        unchanged tenant renders an identical payload and no frame is sent.
+        """
+        now = now or datetime.now(timezone.utc)
+        payload: Dict[str, Any] = {"in_use": bool(self.sessions)}
+        if self.sessions:
+            holder = self.sessions[0]
+            payload.update(name=self.name(holder.student_id), **self.timing(holder, now))
+        payload.update(self._common())
+        payload["active_sessions"] = [
+            {"id": sess.id, "name": self.name(sess.student_id), **self.timing(sess, now)}
+            for sess in self.sessions
+        ]
+        payload["queue"] = [self.name(sid, "Unknown") for sid in self.queue]
+        return payload
+
+    def to_status(self, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """Payload for /api/status polls.
+
+        elapsed is kept for older clients; current ones compute it from start
+        (or overdue_at) and server_time.
+        """
+        now = now or datetime.now(timezone.utc)
+        payload = self.to_event(now)
+        if self.sessions:
+            payload["elapsed"] = int((now - self.sessions[0].start_ts).total_seconds())
+        for sess, item in zip(self.sessions, payload["active_sessions"]):
+            item["elapsed"] = int((now - sess.start_ts).total_seconds())
+        payload["server_time"] = now.isoformat()
+        payload["queue_list"] = self.queue_list()
+        return payload
+
+
+class StatusService:
+    def __init__(self, db, queue_model, session_service, roster_service,
+                 get_settings: Callable[[Optional[int]], Dict[str, Any]], tz, ttl: float = 0.5):
+        """
+        Initialize StatusService.
+
+        Args:
+            db: SQLAlchemy database instance
+            queue_model: Queue model class
+            session_service: SessionService (open sessions)
+            roster_service: RosterService (batched name lookup)
+            get_settings: Returns a tenant's settings dict
+            tz: Local timezone that session times are rendered in
+            ttl: Seconds a snapshot is reused; 0 disables caching
+        """
+        self.db = db
+        self.Queue = queue_model
+        self.session_service = session_service
+        self.roster_service = roster_service
+        self.get_settings = get_settings
+        self.tz = tz
+        self.ttl = ttl
+        # {user_id: (snapshot, built_at)}
+        self._cache: Dict[Optional[int], tuple] = {}
+        # {user_id: (version, overdue deadlines)}; kept until the version moves
+        self._deadlines: Dict[Optional[int], tuple] = {}
+        self._lock = threading.Lock()
+
+    def snapshot(self, user_id: Optional[int], version: Optional[int] = None) -> StatusSnapshot:
+        """Get a tenant's snapshot, reusing a recent one.
+
+        With a version (the tenant's state_version, read before calling), a
+        cached snapshot is only reused if it was built at that same version,
+        so a body is never older than the ETag it is sent with.
+        """
+        if self.ttl > 0:
+            cached = self._cache.get(user_id)
+            if cached:
+                snap, built_at = cached
+                if time.monotonic() - built_at < self.ttl and (version is None or snap.version == version):
+                    return snap
+        snap = self.build(user_id, version)
+        if self.ttl > 0:
+            with self._lock:
+                self._cache[user_id] = (snap, time.monotonic())
+        return snap
+
+    def build(self, user_id: Optional[int], version: Optional[int] = None) -> StatusSnapshot:
+        """Read a tenant's state from the database"""
+        settings = self.get_settings(user_id)
+        sessions = [OpenSession(s.id, s.student_id, s.start_ts)
+                    for s in self.session_service.get_open_sessions(user_id)]
+        queue = [student_id for (student_id,) in self.db.session.query(self.Queue.student_id)
+                 .filter_by(user_id=user_id).order_by(self.Queue.joined_ts.asc())]
+        names: Dict[str, str] = {}
+        if sessions or queue:
+            names = self.roster_service.get_student_names(
+                user_id, list(dict.fromkeys([s.student_id for s in sessions] + queue)), fallback="")
+        return StatusSnapshot(settings, sessions, queue, names, self.tz, version)
+
+    def overdue_count(self, user_id: Optional[int], version: int, now: datetime) -> int:
+        """Open sessions overdue at `now`, for a tenant at state `version`.
+
+        Deadlines only move when the version does (sessions, settings), so
+        they are kept per version and a repeat call doesn't read the database.
+        """
+        cached = self._deadlines.get(user_id)
+        if cached is None or cached[0] != version:
+            deadlines = self.snapshot(user_id, version).overdue_deadlines()
+            with self._lock:
+                self._deadlines[user_id] = (version, deadlines)
+        else:
+            deadlines = cached[1]
+        return sum(1 for deadline in deadlines if now > deadline)
+
+    def invalidate(self, user_id: Optional[int] = None) -> None:
+        """Drop one tenant's cached snapshot (or all of them)"""
+        with self._lock:
+            if user_id is None:
+                self._cache.clear()
+                self._deadlines.clear()
+            else:
+                self._cache.pop(user_id, None)
+                self._deadlines.pop(user_id, None)
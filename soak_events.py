@@ -0,0 +1,201 @@
+"""
+Soak test for /events: hold many concurrent SSE streams open against one server process.
+
+Usage: python soak_events.py [--streams N] [--url URL --token TOKEN --code CODE]
+
+Without --url it seeds a scratch SQLite database and starts
+`gunicorn -c gunicorn.conf.py --workers 1` on a free local port. It then
+opens N /events streams, checks that every stream receives its initial frame,
+times /api/status while the streams stay open, scans a student and checks
+that the change reaches every stream. Exits non-zero if any check fails.
+"""
+import argparse
+import json
+import os
+import resource
+import selectors
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from urllib.parse import urlsplit
+
+SOAK_CODE = "100001"
+
+
+def seed(db_url):
+    """Create one tenant with a one-student roster and return its kiosk token"""
+    os.environ["DATABASE_URL"] = db_url
+    from app import app, db, User, initialize_database_if_needed, roster_service
+
+    initialize_database_if_needed()
+    with app.app_context():
+        user = User(google_id="soak", email="soak@example.com", name="Soak")
+        db.session.add(user)
+        db.session.commit()
+        roster_service.store_student_names_batch(user.id, {SOAK_CODE: "Soak Student"})
+        return user.kiosk_token
+
+
+def spawn_server(db_url):
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    env = dict(os.environ, DATABASE_URL=db_url)
+    root = os.path.dirname(os.path.abspath(__file__))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", "1",
+         "--bind", f"127.0.0.1:{port}", "app:app"],
+        cwd=root, env=env,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"{url}/api/status", timeout=1).read()
+            return proc, url
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise SystemExit("server did not start")
+
+
+def post_json(url, payload):
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(),
+                                 headers={"Content-Type": "application/json"})
+    return urllib.request.urlopen(req, timeout=10).read()
+
+
+class Streams:
+    """N raw /events connections drained by a single selector loop"""
+
+    def __init__(self, url, token, count):
+        parts = urlsplit(url)
+        self.address = (parts.hostname, parts.port or 80)
+        self.request = (f"GET /events?token={token} HTTP/1.0\r\n"
+                        f"Host: {parts.netloc}\r\nAccept: text/event-stream\r\n\r\n").encode()
+        self.count = count
+        self.frames = {}
+        self.closed = 0
+        self.selector = selectors.DefaultSelector()
+
+    def open(self):
+        for _ in range(self.count):
+            sock = socket.create_connection(self.address, timeout=10)
+            sock.sendall(self.request)
+            sock.setblocking(False)
+            self.frames[sock] = 0
+            self.selector.register(sock, selectors.EVENT_READ)
+
+    def pump(self, seconds):
+        deadline = time.time() + seconds
+        while time.time() < deadline:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    data = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    self.selector.unregister(key.fileobj)
+                    self.closed += 1
+                    continue
+                self.frames[key.fileobj] += data.count(b"data: ")
+
+    def wait_for(self, minimum, seconds):
+        """Pump until every stream has seen `minimum` frames; returns seconds taken or None"""
+        started = time.time()
+        while time.time() - started < seconds:
+            self.pump(0.1)
+            if self.reached(minimum) == self.count:
+                return time.time() - started
+        return None
+
+    def reached(self, minimum):
+        return sum(1 for n in self.frames.values() if n >= minimum)
+
+    def close(self):
+        for sock in list(self.frames):
+            sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--streams", type=int, default=1000)
+    parser.add_argument("--url", help="Target a running server instead of starting one")
+    parser.add_argument("--token", help="Kiosk token for --url")
+    parser.add_argument("--code", default=SOAK_CODE, help="Rostered student code to scan")
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < args.streams + 256:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, args.streams + 256), hard))
+
+    proc = None
+    if args.url:
+        url, token = args.url.rstrip("/"), args.token
+    else:
+        db_url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='hallpass-soak-'), 'soak.db')}"
+        token = seed(db_url)
+        proc, url = spawn_server(db_url)
+
+    failures = []
+    streams = Streams(url, token, args.streams)
+    try:
+        started = time.time()
+        streams.open()
+        connected = streams.wait_for(1, 60)
+        print(f"{args.streams} streams open, initial frame on {streams.reached(1)} "
+              f"({time.time() - started:.2f}s)")
+        if connected is None:
+            failures.append("not every stream received its initial frame")
+
+        # Normal API requests while the streams are held open
+        latencies = []
+
+        def time_status():
+            for _ in range(50):
+                t = time.perf_counter()
+                urllib.request.urlopen(f"{url}/api/status?token={token}", timeout=10).read()
+                latencies.append(time.perf_counter() - t)
+
+        worker = threading.Thread(target=time_status)
+        worker.start()
+        while worker.is_alive():
+            streams.pump(0.1)
+        worker.join()
+        if len(latencies) < 50:
+            failures.append("/api/status requests failed while streams were open")
+        else:
+            print(f"/api/status with streams open: p50 {statistics.median(latencies) * 1000:.1f}ms "
+                  f"max {max(latencies) * 1000:.1f}ms")
+
+        # A change must reach every open stream
+        threading.Thread(target=post_json, args=(f"{url}/api/scan",
+                                                 {"token": token, "code": args.code})).start()
+        fanned = streams.wait_for(2, 30)
+        print(f"scan delivered to {streams.reached(2)}/{args.streams} streams"
+              + (f" in {fanned:.2f}s" if fanned is not None else ""))
+        if fanned is None:
+            failures.append("change did not reach every stream")
+        if streams.closed:
+            failures.append(f"{streams.closed} streams were closed by the server")
+    finally:
+        streams.close()
+        if proc is not None:
+            proc.terminate()
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()